@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# The keys of the machine description that must match the baseline for the timings to be comparable
+MACHINE_KEYS = ('machine', 'cpu', 'n_cpus')
+
+
+def get_machine():
+    """Describe the machine (and the versions) the benchmark runs on."""
+    cpu = platform.processor()
+    if os.path.isfile('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as file:
+            cpu = next((line.split(':', 1)[1].strip() for line in file if line.startswith('model name')), cpu)
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'cpu': cpu, 'n_cpus': os.cpu_count()}
+
+
+def _best_time(function, repeat):
+    """Return the best wall time of `repeat` calls of a function, and its last output."""
+    best = np.inf
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function()
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def bench_turn(repeat=3):
+    """Time and peak memory of the construction of `Turn()`."""
+    from game.components import Turn
+
+    Turn()  # The shared indexes and probabilities are built once, outside the measure
+    duration, _ = _best_time(Turn, repeat)
+
+    tracemalloc.start()
+    turn = Turn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return turn, {
+        'turn_build_time': {'value': duration, 'unit': 's', 'higher_is_better': False},
+        'turn_peak_memory': {'value': peak / 2 ** 20, 'unit': 'MiB', 'higher_is_better': False},
+    }
+
+
+def bench_episodes(turn, n_episodes=1000, repeat=3):
+    """Throughput of the generation of episodes, on the objects and on the compiled arrays."""
+    from learning.utils import generate_episode, generate_episodes
+
+    origin_state = turn.states[0]
+    duration, _ = _best_time(lambda: [generate_episode(origin_state) for _ in range(n_episodes)], repeat)
+    compiled = turn.compile()
+    rng = np.random.default_rng(0)
+    batch_duration, _ = _best_time(lambda: generate_episodes(compiled, n_episodes, rng=rng), repeat)
+
+    return {
+        'generate_episode': {'value': n_episodes / duration, 'unit': 'episodes/s', 'higher_is_better': True},
+        'generate_episodes': {'value': n_episodes / batch_duration, 'unit': 'episodes/s', 'higher_is_better': True},
+    }
+
+
+def bench_algorithms(turn, n_iters=(1000,), repeat=1):
+    """Throughput of the learning algorithms, for each number of iterations."""
+    from learning.monte_carlo import predictions, exploring_starts, on_policy_control
+    from learning.temporal_differences import td0, sarsa, expected_sarsa, q_learning
+    from learning.tables import PolicyTables
+
+    tables = PolicyTables.from_policy(turn)
+    algorithms = {
+        'predictions': lambda n_iter: predictions(tables, gamma=.8, n_iter=n_iter, rng=0),
+        'exploring_starts': lambda n_iter: exploring_starts(tables, gamma=.8, n_iter=n_iter, rng=0),
+        'on_policy_control': lambda n_iter: on_policy_control(tables, gamma=.8, epsilon=.25, n_iter=n_iter, rng=0),
+        'td0': lambda n_iter: td0(tables, alpha=.5, gamma=.8, n_iter=n_iter, rng=0),
+        'sarsa': lambda n_iter: sarsa(tables, alpha=.5, gamma=.8, n_iter=n_iter, rng=0),
+        'expected_sarsa': lambda n_iter: expected_sarsa(tables, alpha=.5, gamma=.8, n_iter=n_iter, rng=0),
+        'q_learning': lambda n_iter: q_learning(tables, alpha=.5, gamma=.8, n_iter=n_iter, rng=0),
+        'td0_batched': lambda n_iter: td0(tables, alpha=.5, gamma=.8, n_iter=n_iter, rng=0, batch_size=1024),
+        'sarsa_batched': lambda n_iter: sarsa(tables, alpha=.5, gamma=.8, n_iter=n_iter, rng=0, batch_size=1024),
+    }
+
+    results = {}
+    for name, algorithm in algorithms.items():
+        for n_iter in n_iters:
+            duration, _ = _best_time(lambda: algorithm(n_iter), repeat)
+            results[f'{name}[n_iter={n_iter}]'] = {'value': n_iter / duration, 'unit': 'iterations/s',
+                                                   'higher_is_better': True}
+    return results
+
+
+def run(n_iters=(100, 1000, 10000), n_episodes=1000, repeat=3):
+    """
+    Run all the benchmarks.
+
+    :param n_iters: The numbers of iterations of the algorithms (their scaling)
+    :param n_episodes: The number of episodes generated to measure their throughput
+    :param repeat: The number of repetitions of the fast measures (the best one is kept)
+
+    :return: A dict of metrics {name: {'value', 'unit', 'higher_is_better'}}
+    """
+    turn, results = bench_turn(repeat)
+    results.update(bench_episodes(turn, n_episodes, repeat))
+    results.update(bench_algorithms(turn, n_iters, repeat))
+    return results
+
+
+def compare(results, baseline, tolerance=.2):
+    """
+    Compare results to a baseline.
+
+    :param results: The metrics of the current run
+    :param baseline: The metrics of the baseline
+    :param tolerance: The relative slowdown above which a metric is a regression
+
+    :return: A list of tuples (name, baseline value, value, relative change, is a regression), the relative
+    change being positive when the metric improves
+    """
+    output = []
+    for name, metric in results.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]['value']
+        change = (metric['value'] - reference) / reference
+        if not metric['higher_is_better']:
+            change = -change
+        output.append((name, reference, metric['value'], change, change < -tolerance))
+    return output
+
+
+def main(output=None, baseline=DEFAULT_BASELINE, save_baseline=False, tolerance=.2, n_iters=(100, 1000, 10000),
+         n_episodes=1000, repeat=3):
+    results = run(n_iters, n_episodes, repeat)
+    machine = get_machine()
+    document = dict(machine, results=results)
+
+    for name, metric in results.items():
+        print('{:<40} {:>14.4g} {}'.format(name, metric['value'], metric['unit']))
+
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(document, file, indent=2)
+
+    if save_baseline:
+        with open(baseline, 'w') as file:
+            json.dump(document, file, indent=2)
+        return 0
+
+    if not os.path.isfile(baseline):
+        print(f'No baseline at {baseline}')
+        return 0
+
+    with open(baseline) as file:
+        reference = json.load(file)
+
+    # Timings of another machine are not comparable: the baseline has to be recorded locally first
+    mismatches = [f'{key} {reference.get(key)!r} != {machine[key]!r}' for key in MACHINE_KEYS
+                  if reference.get(key) != machine[key]]
+    if mismatches:
+        print(f'The baseline {baseline} was recorded on another machine ({", ".join(mismatches)}): '
+              f'record one on this machine with --save-baseline before comparing')
+        return 0
+
+    comparison = compare(results, reference['results'], tolerance)
+
+    print()
+    print('{:<40} {:>14} {:>14} {:>9}'.format('Comparison to the baseline', 'baseline', 'current', 'change'))
+    for name, reference, value, change, is_regression in comparison:
+        print('{:<40} {:>14.4g} {:>14.4g} {:>+8.1%}{}'.format(name, reference, value, change,
+                                                              '  REGRESSION' if is_regression else ''))
+    return int(any(is_regression for *_, is_regression in comparison))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the environment and of the learning algorithms')
+    parser.add_argument('--output', help='Path of the JSON file to write the results to')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Path of the JSON baseline to compare to')
+    parser.add_argument('--save-baseline', action='store_true', help='Replace the baseline by the results')
+    parser.add_argument('--tolerance', type=float, default=.2,
+                        help='Relative slowdown above which a metric is reported as a regression')
+    parser.add_argument('--n-iter', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Numbers of iterations of the algorithms')
+    parser.add_argument('--n-episodes', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    sys.exit(main(output=args.output, baseline=args.baseline, save_baseline=args.save_baseline,
+                  tolerance=args.tolerance, n_iters=args.n_iter, n_episodes=args.n_episodes, repeat=args.repeat))
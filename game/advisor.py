@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import json
+
+import numpy as np
+
+from game.cache import load_turn
+from game.indexing import get_hand_index
+from game.rules import DEFAULT_RULES
+from learning.dynamic_programming import value_iteration
+from learning.tables import PolicyTables, get_tables
+
+
+def _has_bool(values):
+    """Whether a (nested) list contains booleans."""
+    if isinstance(values, (list, tuple)):
+        return any(_has_bool(value) for value in values)
+    return isinstance(values, (bool, np.bool_))
+
+
+class Advisor:
+    """
+    Lookup table of the best action of a policy for every hand at every roll: the advice for a batch
+    of hands is read with a few array indexing operations, without any `Turn()`.
+    """
+
+    def __init__(self, policy, rules=None):
+        """
+        :param policy: The learned or solved policy (a `Turn()` or its PolicyTables())
+        :param rules: The Rules() of the turn (those of the `Turn()`, or the default rules if None)
+        """
+        if rules is None:
+            rules = getattr(policy, 'rules', DEFAULT_RULES)
+        tables = get_tables(policy)
+        compiled = tables.compiled
+        self.rules = rules
+        self.steps = tuple(range(1, rules.final_step + 1))
+        self.hand_index = get_hand_index(rules.n_dice, rules.min_value, rules.max_value)
+        if compiled.n_states != len(self.steps) * len(self.hand_index) + 2:
+            raise ValueError(f'The policy does not follow the rules {rules}: the rules of PolicyTables() '
+                             f'must be given with `rules`.')
+
+        # Best action of each state: the most probable one, the ties being broken by the action values
+        has_actions = compiled.n_actions_per_state > 0
+        order = np.lexsort((-tables.action_values, -tables.probabilities, compiled.action_states))
+        best_actions = np.full(compiled.n_states, -1)
+        best_actions[has_actions] = order[compiled.action_ptr[:-1][has_actions]]
+
+        # best_actions[step - 1, rank]: best action of the hand of rank `rank` at the roll `step`
+        hands = [tuple(hand) for hand in self.hand_index.hands.tolist()]
+        states = np.array([[compiled.state_index[(step, hand)] for hand in hands] for step in self.steps])
+        self.best_actions = best_actions[states]
+        self.values = tables.state_values[states]
+
+        # What each action means: the dice kept (padded with 0) and the category chosen (-1 for none)
+        self.keeps = np.zeros((compiled.n_actions, rules.n_dice), dtype=np.int64)
+        self.n_keep = np.zeros(compiled.n_actions, dtype=np.int64)
+        self.categories = np.full(compiled.n_actions, -1)
+        for i, (_, action_id) in enumerate(compiled.action_ids):
+            n_keep, keep = action_id[0], action_id[1]
+            self.keeps[i, :len(keep)] = keep
+            self.n_keep[i] = n_keep
+            if len(action_id) > 2:
+                self.categories[i] = rules.categories.index(action_id[2])
+        self.action_values = tables.action_values
+
+    @classmethod
+    def optimal(cls, cache_dir=None, rules=None):
+        """Return the Advisor() of the optimal policy of a turn, solved on the cached compiled environment."""
+        return cls(value_iteration(PolicyTables(load_turn(cache_dir=cache_dir, rules=rules))), rules)
+
+    def best(self, hands, step):
+        """
+        Return the best actions for a batch of hands.
+
+        :param hands: Array of hands of shape (n_hands, n_dice), in any order of the dice
+        :param step: The roll the hands come from (1 to `rules.n_rolls`)
+
+        :return: An array of action ids (of the compiled policy)
+        """
+        if step not in self.steps:
+            raise ValueError(f"'step' must be one of {self.steps}: {step} has been given.")
+        return self.best_actions[step - 1, self.hand_index.rank(hands)]
+
+    def advise(self, hands, step):
+        """
+        Return the advice for a batch of hands.
+
+        :param hands: Array of hands of shape (n_hands, n_dice), in any order of the dice
+        :param step: The roll the hands come from (1 to `rules.n_rolls`)
+
+        :return: A tuple of arrays (dice to keep padded with 0 of shape (n_hands, n_dice), number of dice to keep,
+        category to score as an index of `rules.categories` or -1 to roll again, expected value of the action)
+        """
+        actions = self.best(hands, step)
+        return self.keeps[actions], self.n_keep[actions], self.categories[actions], self.action_values[actions]
+
+    def answer(self, request):
+        """
+        Answer a request {'hand': [...], 'step': k} or {'hands': [[...], ...], 'step': k}.
+
+        :return: A dict {'keep', 'category', 'value'}, or a list of them for a batch of hands
+        """
+        is_batch = 'hands' in request
+        raw_hands = request['hands'] if is_batch else [request['hand']]
+        values = np.asarray(raw_hands)
+        rules = self.rules
+        # The booleans would be read as the dice 0 and 1
+        if _has_bool(raw_hands) or values.dtype.kind not in 'iuf' or (values != np.round(values)).any():
+            raise ValueError(f'The hands must be lists of {rules.n_dice} integer dice.')
+        hands = values.astype(np.int64)
+        if (hands.ndim != 2 or hands.shape[1] != rules.n_dice or
+                ((hands < rules.min_value) | (hands > rules.max_value)).any()):
+            raise ValueError(f'The hands must be lists of {rules.n_dice} dice between {rules.min_value} '
+                             f'and {rules.max_value}.')
+
+        step = request['step']
+        if isinstance(step, (bool, np.bool_)) or not isinstance(step, (int, float, np.integer, np.floating)) or \
+                not float(step).is_integer():
+            raise ValueError(f"'step' must be one of {self.steps}: {step!r} has been given.")
+
+        keeps, n_keep, categories, values = self.advise(hands, int(step))
+        answers = [{'keep': keep[:n].tolist(),
+                    'category': rules.categories[category] if category >= 0 else None,
+                    'value': float(value)}
+                   for keep, n, category, value in zip(keeps, n_keep, categories, values)]
+        return answers if is_batch else answers[0]
+
+    async def handle(self, reader, writer):
+        """
+        Answer the requests of a connection: one JSON request per line, one JSON answer per line
+        ({'error': message} for an invalid request).
+        """
+        try:
+            while line := await reader.readline():
+                try:
+                    response = self.answer(json.loads(line))
+                except (ValueError, KeyError, TypeError) as error:
+                    response = {'error': str(error)}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """Serve the advice on a local TCP port (line-delimited JSON), until cancelled."""
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the optimal advice of a turn over local TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    asyncio.run(Advisor.optimal().serve(args.host, args.port))
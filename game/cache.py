@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+
+from game.engine import compile_turn, get_probabilities
+from game.rules import DEFAULT_RULES
+from learning.compiled import save_compiled, load_compiled
+
+# Bump when the layout of the cached environment changes
+CACHE_VERSION = 4
+DEFAULT_CACHE_DIR = os.environ.get('YATHZEE_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'yathzee'))
+
+
+def get_rules(rules=None):
+    """
+    Returns the rules configuration the environment is built with.
+
+    :param rules: The Rules() of the turn (the default rules if None)
+
+    :return: A JSON-serializable dict
+    """
+    return (DEFAULT_RULES if rules is None else rules).as_dict()
+
+
+def get_cache_key(init_policy='uniform', rules=None):
+    """
+    Returns the key of the cached environment, which changes with the rules configuration.
+
+    :param init_policy: The initial policy of the environment
+    :param rules: The Rules() of the turn (the default rules if None)
+
+    :return: A str
+    """
+    config = {'rules': get_rules(rules), 'init_policy': init_policy, 'version': CACHE_VERSION}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_turn(init_policy='uniform', cache_dir=None, mmap_mode='r', rules=None):
+    """
+    Returns the compiled form of `Turn()`, loaded from the on-disk cache. On a cache miss, the
+    environment is built with `compile_turn` and saved for the next calls.
+
+    Only the uniform policy is cached: the probabilities of a 'random' initial policy are drawn again at each call.
+
+    :param init_policy: The initial policy of the environment ('uniform' or 'random')
+    :param cache_dir: The cache directory (`$YATHZEE_CACHE_DIR` or `~/.cache/yathzee` by default)
+    :param mmap_mode: Memory-map mode of the arrays (see `numpy.load`)
+    :param rules: The Rules() of the turn (the default rules if None)
+
+    :return: A CompiledPolicy()
+    """
+    if init_policy not in ('random', 'uniform'):
+        raise ValueError(f"'init_policy' must be one of ('random', 'uniform'): '{init_policy}' has been given.")
+
+    path = os.path.join(cache_dir or DEFAULT_CACHE_DIR, f'turn-{get_cache_key(rules=rules)}')
+    if not os.path.isdir(path):
+        # Another process saving the same environment first is a cache hit as well
+        save_compiled(compile_turn(rules), path, metadata={'rules': get_rules(rules), 'init_policy': 'uniform'})
+    compiled = load_compiled(path, mmap_mode=mmap_mode)
+    if init_policy == 'random':
+        compiled.probabilities = get_probabilities(compiled.action_ptr, init_policy)
+    return compiled
@@ -1,7 +1,9 @@
 from abc import ABC
 
 from learning.components import State, StatesList, Action, Policy
-from game.utils import get_combinations, get_choices
+from game.indexing import get_hand_index
+from game.rules import DEFAULT_RULES
+from game.utils import get_choices, get_roll_probabilities
 # from game import utils
 
 
@@ -21,6 +23,7 @@ class Combination(tuple, State):
         super().__init__(is_terminal)
         self._state = tuple((step, tuple(combination)))
         self._step = step
+        self._lazy_policy = None  # Policy building the actions on their first access (lazy mode)
 
     def __getnewargs__(self):
         return self._state[1], self._step, self.is_terminal
@@ -35,18 +38,57 @@ class Combination(tuple, State):
     def step(self):
         return self._step
 
+    @property
+    def actions(self):
+        if self._lazy_policy is not None:
+            policy, self._lazy_policy = self._lazy_policy, None
+            self.set_actions(get_choices(self, policy.rules))
+            for action in self._actions:
+                action._lazy_policy = policy
+            self._actions.init_probabilities(policy.init_policy)
+        return self._actions
+
 
 class CombinationList(StatesList, ABC):
+    # Slotted like the actions: a turn holds one list of next states per afterstate
+    __slots__ = ('_index', '_weights')
 
-    def __init__(self, combinations, n_keep):
-        list.__init__(combinations)
-        # self._distribution = get_combinations_distribution(n_keep)
+    def __init__(self, combinations=(), n_keep=None):
+        StatesList.__init__(self, combinations)
+        self._index = None  # Position of each combination id, built on the first `append`
         self._weights = []
         self._update_weights()
 
-    def append(self, item):
-        super(CombinationList, self).append(item)
-        self._update_weights()
+    def append(self, item, weight=None):
+        """
+        Append a combination with its transition probability.
+
+        Without `weight`, all the combinations of the list are equally likely. If the combination
+        is already in the list, its weight is added to the existing one.
+        """
+        if self._index is None:
+            self._index = {combination.id: i for i, combination in enumerate(self)}
+        index = self._index.get(item.id)
+        if index is None:
+            self._index[item.id] = len(self)
+            super(CombinationList, self).append(item)
+            if weight is not None:
+                self._weights.append(weight)
+        elif weight is not None:
+            self._weights[index] += weight
+
+        if weight is None:
+            self._update_weights()
+        self._sampler = None
+
+    def __reduce_ex__(self, protocol):
+        # Rebuild the list from its items, instead of appending them one by one over the copied weights
+        return self.__class__, (list(self),), self._get_slots()
+
+    def _get_slots(self):
+        """Return the pickled state of the list: the values of its slots (there is no `__dict__`)."""
+        names = [name for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())]
+        return None, {name: getattr(self, name) for name in names}
 
     def _update_weights(self):
         if len(self) > 0:
@@ -57,7 +99,63 @@ class CombinationList(StatesList, ABC):
         return self._weights
 
 
+class Afterstate(CombinationList):
+    """
+    The dice kept before rolling the others, leading to the states of a given step. It holds the next
+    states and their probabilities, shared by all the choices keeping the same dice towards the same step.
+    Its value is not stored on the object: the algorithms compute it once per afterstate on the compiled
+    environment (see `CompiledPolicy.afterstate_values`).
+    """
+
+    __slots__ = ('_step', '_keep_combination')
+
+    def __init__(self, step, keep_combination, combinations=()):
+        CombinationList.__init__(self, combinations)
+        self._step = step
+        self._keep_combination = tuple(keep_combination)
+
+    def __reduce_ex__(self, protocol):
+        return self.__class__, (self._step, self._keep_combination, list(self)), self._get_slots()
+
+    def populate(self, policy):
+        """Append the next states, with the probability of rolling them."""
+        rules = policy.rules
+        if self._step == rules.terminal_step:
+            self.append(policy.get_states(step=self._step), 1.)
+        elif len(self._keep_combination) == rules.n_dice:
+            self.append(policy.get_state(self._step, self._keep_combination), 1.)
+        else:
+            combinations = policy.get_states(step=self._step)
+
+            # Exact multinomial probability of each distinct outcome of the re-rolled dice
+            outcomes = get_roll_probabilities(rules.n_dice - len(self._keep_combination), rules.min_value,
+                                              rules.max_value)
+            ranks = policy.hand_index.rank([self._keep_combination + completed for completed in outcomes])
+            for rank, probability in zip(ranks, outcomes.values()):
+                self.append(combinations[rank], probability)
+
+        # The outcomes are all distinct: the index of the positions is not kept once the list is complete
+        self._index = None
+
+    @property
+    def id(self):
+        return tuple((self._step, self._keep_combination))
+
+    @property
+    def step(self):
+        return self._step
+
+    @property
+    def keep_combination(self):
+        return self._keep_combination
+
+
+# Ids of the choices, shared by the choices keeping the same dice (in any state)
+_CHOICE_IDS = {}
+
+
 class Choice(Action, ABC):
+    __slots__ = ('_keep_combination', '_n_keep', '_lazy_policy')
 
     # Les actions que je peux faire:
     #   - Garder 0 dé, relancer 5  (6**5 successeurs)
@@ -70,12 +168,13 @@ class Choice(Action, ABC):
         super().__init__(**kwargs)
 
         if keep_combination is None:
-            keep_combination = list()
+            keep_combination = ()
 
-        self._keep_combination = list(keep_combination)
+        # A tuple of the KeepIndex() is shared, not copied, by all the choices keeping the same dice
+        self._keep_combination = tuple(keep_combination)
         self._n_keep = len(keep_combination)
-        self._action = tuple((self._n_keep, tuple(self._keep_combination)))
-        self._to_states = CombinationList([], n_keep=self._n_keep)
+        self._action = _CHOICE_IDS.setdefault(self._keep_combination, (self._n_keep, self._keep_combination))
+        self._lazy_policy = None  # Policy populating the next states on their first access (lazy mode)
 
     def __repr__(self):
         return f'{{n_keep: {self.n_keep}, keep_combination: ' \
@@ -84,26 +183,22 @@ class Choice(Action, ABC):
     def populate_next(self, policy):
 
         if not self.from_state.is_terminal:
+            # Keeping all the dice leads directly to the choice of the pattern
+            rules = policy.rules
+            next_step = rules.final_step if self._n_keep == rules.n_dice else self.from_state.step + 1
+            self._to_states = policy.get_afterstate(next_step, self._keep_combination)
 
-            if self._n_keep == 5:
-                combination = policy.get_states(step=3)
-                for value in self._keep_combination:
-                    combination = combination[value]
-                self._to_states.append(combination)
-            else:
-                next_step = self.from_state.step + 1
-
-                completed_combinations = get_combinations(5 - self.n_keep, next_step, return_list=True)
-                # completed_combinations = utils.get_combinations(5 - self.n_keep, next_step, return_list=True)
-                for completed in completed_combinations:
-                    searched_combination = sorted(self.keep_combination + completed)
-                    combination = policy.get_states(step=next_step)
-                    for value in searched_combination:
-                        combination = combination[value]
-                    self._to_states.append(combination)
+    @property
+    def to_states(self):
+        if self._lazy_policy is not None:
+            policy, self._lazy_policy = self._lazy_policy, None
+            self.populate_next(policy)
+        return self._to_states
 
-            # TODO: temporaire
-            self.to_states._distribution = [1 / len(self.to_states)] * len(self.to_states)
+    @property
+    def afterstate(self):
+        """The Afterstate() shared by the choices keeping the same dice towards the same step."""
+        return self.to_states
 
     @property
     def n_keep(self):
@@ -111,7 +206,7 @@ class Choice(Action, ABC):
 
     @property
     def keep_combination(self):
-        return self._keep_combination
+        return list(self._keep_combination)
 
     @property
     def reward(self):
@@ -119,10 +214,12 @@ class Choice(Action, ABC):
 
 
 class FinalChoice(Choice, ABC):
+    __slots__ = ('_name', '_reward')
 
     def __init__(self, name, reward, **kwargs):
         super().__init__(**kwargs)
-        self._action = self._action + tuple((name,))
+        # Shared by the final choices of the same hand and pattern (as the ids of the choices)
+        self._action = _CHOICE_IDS.setdefault((self._keep_combination, name), self._action + tuple((name,)))
         self._name = name
         self._reward = reward
 
@@ -132,11 +229,7 @@ class FinalChoice(Choice, ABC):
                f'reward: {self._reward}}}'
 
     def populate_next(self, policy):
-        combination = policy.get_states(step=4)
-        if not isinstance(combination, Combination):
-            for value in self.keep_combination:
-                combination = combination[value]
-        self._to_states.append(combination)
+        self._to_states = policy.get_afterstate(policy.rules.terminal_step, ())
 
     @property
     def name(self):
@@ -149,46 +242,121 @@ class FinalChoice(Choice, ABC):
 
 class Turn(Policy):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, lazy=False, rules=None, **kwargs):
+        """
+        :param lazy: If True, the actions of a state and the next states of an action are only built
+                     on their first access, then memoized
+        :param rules: The Rules() of the turn (5 dice with 6 faces, 3 rolls and all the categories by default)
+        """
         super().__init__(*args, **kwargs)
 
         self._step = 0
         self._selected_dices = []
         self._selection = False
+        self._lazy = lazy
+        self._rules = rules = DEFAULT_RULES if rules is None else rules
+        self._hand_index = get_hand_index(rules.n_dice, rules.min_value, rules.max_value)
+        self._afterstates = {}
 
         self.__init_states()
         self.execute()
 
     def __init_states(self):
+        rules = self._rules
+        terminal_step = rules.terminal_step
 
         init_state = Combination([], step=0, is_terminal=False)
-        init_state.set_actions(get_choices(init_state))
+        if not self._lazy:
+            init_state.set_actions(get_choices(init_state, rules))
         # init_state.set_actions(utils.get_choices(init_state))
 
+        # The combinations of each step are stored in the order of their rank in the HandIndex()
         self.__states_architecture = dict([(0, init_state)])
-        for step in range(1, 4):
-            self.__states_architecture[step] = get_combinations(n_dice=5, step=step, is_terminal=False)
-        self.__states_architecture[4] = Combination([], step=4, is_terminal=True)
+        for step in range(1, terminal_step):
+            combinations = [Combination(hand, step=step, is_terminal=False) for hand in self._hand_index.hands.tolist()]
+            if not self._lazy:
+                for combination in combinations:
+                    combination.set_actions(get_choices(combination, rules))
+            self.__states_architecture[step] = combinations
+        self.__states_architecture[terminal_step] = Combination([], step=terminal_step, is_terminal=True)
+
+        self._states = [init_state]
+        self._offsets = {0: 0}
+        for step in range(1, terminal_step):
+            self._offsets[step] = len(self._states)
+            self._states += self.__states_architecture[step]
+        self._offsets[terminal_step] = len(self._states)
+        self._states.append(self.__states_architecture[terminal_step])
+
+    def execute(self):
+        if not self._lazy:
+            return super().execute()
+
+        # The states build their actions (and link them to their next states) on their first access, the
+        # states already built only draw their initial probabilities again
+        self._compiled = None
+        for state in self.states:
+            if state.is_terminal:
+                continue
+            if len(state._actions) == 0:
+                state._lazy_policy = self
+            else:
+                state._actions.init_probabilities(self.init_policy)
+
+    @property
+    def lazy(self):
+        return self._lazy
 
-        self._states = self._dive_in_dict_states(self.__states_architecture)
+    @property
+    def rules(self):
+        return self._rules
 
     @property
     def states(self):
         return self._states
 
+    @property
+    def hand_index(self):
+        return self._hand_index
+
     def get_states(self, step):
+        """
+        Return the states of a step: the list of the Combination() of the rolls (ordered by their rank
+        in `hand_index`), or the single initial (step 0) or final (`rules.terminal_step`) Combination().
+        """
         return self.__states_architecture[step]
 
-    def _dive_in_dict_states(self, states, store=None):
-        if store is None:
-            store = []
+    def get_state(self, step, combination):
+        """Return the Combination() state of a given step for a given hand (sorted or not)."""
+        if step in (0, self._rules.terminal_step):
+            return self.__states_architecture[step]
+        return self.__states_architecture[step][self._hand_index.rank_one(combination)]
 
-        for k, v in states.items():
-            if isinstance(v, Combination):
-                store.append(v)
-            else:
-                self._dive_in_dict_states(v, store)
-        return store
+    @property
+    def afterstates(self):
+        """The Afterstate() shared by the actions, once they are linked to their next states."""
+        return list(self._afterstates.values())
+
+    def get_afterstate(self, step, keep_combination):
+        """Return the (shared) Afterstate() of keeping some dice before rolling the others towards a given step."""
+        key = tuple((step, tuple(keep_combination)))
+        afterstate = self._afterstates.get(key)
+        if afterstate is None:
+            afterstate = Afterstate(step, keep_combination)
+            afterstate.populate(self)
+            self._afterstates[key] = afterstate
+        return afterstate
+
+    def get_state_index(self, step, combinations):
+        """
+        Return the position in `states` (which is also the compiled state id) of a batch of hands at a given step.
+
+        :param step: The step of the hands (1 to `rules.n_rolls`)
+        :param combinations: Array of hands of shape (n_hands, n_dice)
+
+        :return: An array of integers
+        """
+        return self._offsets[step] + self._hand_index.rank(combinations)
 
     # def roll(self):
     #     if self._selection:
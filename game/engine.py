@@ -0,0 +1,169 @@
+from math import factorial
+
+import numpy as np
+
+from game.indexing import get_hand_index, get_keep_index
+from game.rules import DEFAULT_RULES
+from game.rewards import get_reward_matrix
+from learning.compiled import CompiledPolicy
+
+
+def get_outcomes(n_dice, min_value=1, max_value=6):
+    """
+    Returns the distinct outcomes (sorted multisets) of rolling a given number of dice, with their exact
+    multinomial probability: the array form of `get_roll_probabilities`.
+
+    :param n_dice: The number of dice to roll
+    :param min_value: The minimum value of the rolled dice
+    :param max_value: The maximum value of the rolled dice
+
+    :return: A tuple (outcomes of shape (n_outcomes, n_dice), probabilities of shape (n_outcomes,))
+    """
+    hand_index = get_hand_index(n_dice, min_value, max_value)
+    factorials = np.array([factorial(count) for count in range(n_dice + 1)], dtype=float)
+    n_permutations = factorial(n_dice) / factorials[hand_index.counts()].prod(axis=1)
+    return hand_index.hands, n_permutations / hand_index.n_faces ** n_dice
+
+
+def get_probabilities(action_ptr, init_policy='uniform'):
+    """
+    Returns the initial probabilities of the actions: uniform, or random (drawn again at each call).
+
+    :param action_ptr: The offsets of the actions of each state (see `CompiledPolicy`)
+    :param init_policy: The initial policy ('uniform' or 'random')
+
+    :return: An array of probabilities, normalized within each state
+    """
+    n_actions = np.diff(action_ptr)
+    action_states = np.repeat(np.arange(len(n_actions)), n_actions)
+    if init_policy == 'random':
+        probabilities = np.random.random(action_ptr[-1])
+    else:
+        probabilities = np.ones(action_ptr[-1])
+    return probabilities / np.bincount(action_states, weights=probabilities, minlength=len(n_actions))[action_states]
+
+
+def compile_turn(rules=None, init_policy='uniform'):
+    """
+    Build the CompiledPolicy() of a turn directly from the hand and keep indexes, without building the
+    objects of `Turn()`: the states, actions and their ids are numbered as in `Turn(rules=rules).compile()`,
+    so that both can be used interchangeably, but the larger variants of the rules (more dice, faces or
+    rolls) are built in a fraction of the time and memory.
+
+    :param rules: The Rules() of the turn (the default rules if None)
+    :param init_policy: The initial policy ('uniform' or 'random')
+
+    :return: A CompiledPolicy()
+    """
+    if init_policy not in ('random', 'uniform'):
+        raise ValueError(f"'init_policy' must be one of ('random', 'uniform'): '{init_policy}' has been given.")
+
+    rules = DEFAULT_RULES if rules is None else rules
+    n_dice, min_value, max_value = rules.n_dice, rules.min_value, rules.max_value
+    final_step, terminal_step = rules.final_step, rules.terminal_step
+    hand_index = get_hand_index(n_dice, min_value, max_value)
+    keep_index = get_keep_index(n_dice, min_value, max_value)
+    n_hands, n_keeps, n_categories = len(hand_index), len(keep_index), len(rules.categories)
+
+    # States: the initial state, the hands of each roll (ordered by rank) and the terminal state
+    n_states = final_step * n_hands + 2
+    terminal_state = n_states - 1
+    is_terminal = np.zeros(n_states, dtype=bool)
+    is_terminal[terminal_state] = True
+
+    # Actions: rolling all the dice, the keeps of the hands before the last roll and the categories after it
+    n_hand_keeps = np.diff(keep_index.ptr)
+    n_actions = np.concatenate(([1], np.tile(n_hand_keeps, final_step - 1), np.full(n_hands, n_categories), [0]))
+    action_ptr = np.concatenate(([0], np.cumsum(n_actions))).astype(np.int64)
+    n_choices = int(n_hand_keeps.sum()) * (final_step - 1)
+
+    rewards = np.zeros(action_ptr[-1])
+    rewards[1 + n_choices:] = get_reward_matrix(rules).ravel()
+
+    # Each action leads to the afterstate (step, keep), keyed by `step * n_keeps + keep`: keeping all the dice
+    # leads directly to the last roll, and the categories to the terminal state
+    choice_steps = np.repeat(np.arange(2, final_step + 1), n_hand_keeps.sum())
+    choice_keeps = np.tile(keep_index.indices, final_step - 1)
+    choice_steps[keep_index.n_keep[choice_keeps] == n_dice] = final_step
+    keys = np.concatenate(([n_keeps], choice_steps * n_keeps + choice_keeps,
+                           np.full(n_hands * n_categories, terminal_step * n_keeps)))
+
+    # The afterstates are numbered in the order of their first action (as `compile_policy` does)
+    unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    afterstate_keys = unique_keys[order]
+    afterstate_ranks = np.empty_like(order)
+    afterstate_ranks[order] = np.arange(len(order))
+    action_afterstates = afterstate_ranks[inverse.ravel()].astype(np.int64)
+
+    steps, keeps = afterstate_keys // n_keeps, afterstate_keys % n_keeps
+    n_keep = keep_index.n_keep[keeps]
+    is_rolled = (steps != terminal_step) & (n_keep < n_dice)
+    n_outcomes = np.array([len(get_hand_index(n_dice - k, min_value, max_value)) for k in range(n_dice + 1)])
+    n_successors = np.where(is_rolled, n_outcomes[n_keep], 1)
+    afterstate_ptr = np.concatenate(([0], np.cumsum(n_successors))).astype(np.int64)
+    afterstate_states = np.empty(afterstate_ptr[-1], dtype=np.int64)
+    afterstate_probabilities = np.ones(afterstate_ptr[-1])
+
+    afterstate_states[afterstate_ptr[:-1][steps == terminal_step]] = terminal_state
+    is_kept = (steps != terminal_step) & ~is_rolled
+    afterstate_states[afterstate_ptr[:-1][is_kept]] = (
+        (steps[is_kept] - 1) * n_hands + 1 + keeps[is_kept] - keep_index.offsets[n_dice])
+
+    # The successors of the keeps of each size, ranked all at once: the keep completed by every outcome
+    for size in range(n_dice):
+        afterstates = np.flatnonzero(is_rolled & (n_keep == size))
+        if len(afterstates) == 0:
+            continue
+        kept = get_hand_index(size, min_value, max_value).hands[keeps[afterstates] - keep_index.offsets[size]]
+        outcomes, probabilities = get_outcomes(n_dice - size, min_value, max_value)
+        hands = np.concatenate((np.repeat(kept[:, None, :], len(outcomes), axis=1),
+                                np.broadcast_to(outcomes, (len(afterstates),) + outcomes.shape)), axis=2)
+        ranks = hand_index.rank(hands).reshape(len(afterstates), len(outcomes))
+
+        positions = afterstate_ptr[afterstates][:, None] + np.arange(len(outcomes))
+        afterstate_states[positions] = (steps[afterstates][:, None] - 1) * n_hands + 1 + ranks
+        afterstate_probabilities[positions] = probabilities
+
+    return CompiledPolicy(
+        state_ids=None,
+        action_ids=None,
+        is_terminal=is_terminal,
+        action_ptr=action_ptr,
+        rewards=rewards,
+        probabilities=get_probabilities(action_ptr, init_policy),
+        action_afterstates=action_afterstates,
+        afterstate_ptr=afterstate_ptr,
+        afterstate_states=afterstate_states,
+        afterstate_probabilities=afterstate_probabilities,
+        ids_loader=lambda: get_ids(rules),
+    )
+
+
+def get_ids(rules=None):
+    """
+    Returns the ids of the states and actions of a turn, in the order of `compile_turn`.
+
+    :param rules: The Rules() of the turn (the default rules if None)
+
+    :return: A tuple (state_ids, action_ids), as the `state_ids` and `action_ids` of a CompiledPolicy()
+    """
+    rules = DEFAULT_RULES if rules is None else rules
+    hand_index = get_hand_index(rules.n_dice, rules.min_value, rules.max_value)
+    keep_index = get_keep_index(rules.n_dice, rules.min_value, rules.max_value)
+    hands = [tuple(hand) for hand in hand_index.hands.tolist()]
+    keep_ids = [(len(keep), keep) for keep in keep_index.keeps]
+
+    init_id = (0, ())
+    state_ids = [init_id]
+    action_ids = [(init_id, (0, ()))]
+    for step in range(1, rules.final_step + 1):
+        for rank, hand in enumerate(hands):
+            state_id = (step, hand)
+            state_ids.append(state_id)
+            if step < rules.final_step:
+                action_ids += [(state_id, keep_ids[keep]) for keep in keep_index.get_keeps(rank).tolist()]
+            else:
+                action_ids += [(state_id, (rules.n_dice, hand, name)) for name in rules.categories]
+    state_ids.append((rules.terminal_step, ()))
+    return state_ids, action_ids
@@ -0,0 +1,209 @@
+import os
+import tempfile
+
+import numpy as np
+
+from game.cache import DEFAULT_CACHE_DIR, get_cache_key
+from game.components import Turn
+from game.rewards import CATEGORIES
+from learning.tables import PolicyTables
+from learning.utils import greedy_probabilities
+
+# The upper section (Count_1 to Count_6) earns a bonus once its subtotal reaches the threshold
+N_UPPER_CATEGORIES = 6
+UPPER_BONUS_THRESHOLD = 63
+UPPER_BONUS = 35
+
+N_SCORECARDS = 2 ** len(CATEGORIES) * (UPPER_BONUS_THRESHOLD + 1)
+
+
+def encode_scorecard(used_categories=(), upper_total=0):
+    """
+    Returns the compact encoding of a scorecard: the set of used categories (13 bits) and the upper
+    subtotal, capped at the bonus threshold (so that reaching it also gives the bonus flag).
+
+    :param used_categories: The used categories, given by their name or their index in `CATEGORIES`
+    :param upper_total: The subtotal of the upper section
+
+    :return: An int in [0, N_SCORECARDS)
+    """
+    mask = 0
+    for category in used_categories:
+        mask |= 1 << (CATEGORIES.index(category) if isinstance(category, str) else category)
+    return mask * (UPPER_BONUS_THRESHOLD + 1) + min(upper_total, UPPER_BONUS_THRESHOLD)
+
+
+def decode_scorecard(scorecard):
+    """
+    Returns the used categories and the (capped) upper subtotal of an encoded scorecard.
+
+    :param scorecard: The encoded scorecard
+
+    :return: A tuple (list of category names, upper subtotal)
+    """
+    mask, upper_total = divmod(scorecard, UPPER_BONUS_THRESHOLD + 1)
+    return [name for i, name in enumerate(CATEGORIES) if mask >> i & 1], upper_total
+
+
+def check_rules(rules):
+    """
+    Check that a full game can be played with the rules of a turn: 5 dice with 6 faces (for the upper bonus
+    threshold) and all the categories of the scorecard, in their usual order. The number of rolls is free.
+
+    :param rules: The Rules() of the turn
+    """
+    if rules.n_dice != 5 or (rules.min_value, rules.max_value) != (1, 6) or list(rules.categories) != CATEGORIES:
+        raise ValueError(f'The full game is only defined for 5 dice with faces 1 to 6 and the categories '
+                         f'{CATEGORIES}: {rules} has been given.')
+
+
+class GameSolver:
+    """
+    Optimal strategy of a whole game of 13 turns, maximising the expected final score (upper bonus
+    included, without the extra Yathzee bonuses). Each turn is solved on the structure of `Turn()`,
+    its final choices being worth their reward plus the value of the resulting scorecard.
+    """
+
+    def __init__(self, turn=None):
+        if turn is None:
+            turn = Turn()
+        check_rules(turn.rules)
+        self.turn = turn
+        self.compiled = compiled = turn.compile()
+
+        # Final choices of the turn: their category, and their gain in the upper section
+        self._final_actions = []
+        categories = []
+        action_id = 0
+        for state in turn.states:
+            for action in state.actions:
+                if state.step == turn.rules.final_step:
+                    self._final_actions.append(action_id)
+                    categories.append(turn.rules.categories.index(action.name))
+                action_id += 1
+        self._final_actions = np.array(self._final_actions)
+        self._category_bits = 1 << np.array(categories)
+        rewards = compiled.rewards[self._final_actions]
+        upper_gains = np.where(np.array(categories) < N_UPPER_CATEGORIES, rewards, 0)
+
+        # Next upper subtotal (and bonus earned) of each final choice, for each current subtotal
+        upper_totals = np.arange(UPPER_BONUS_THRESHOLD + 1)[:, None]
+        self._next_upper_totals = np.minimum(upper_totals + upper_gains, UPPER_BONUS_THRESHOLD).astype(np.int64)
+        self._final_rewards = rewards + np.where((upper_totals < UPPER_BONUS_THRESHOLD) &
+                                                 (self._next_upper_totals == UPPER_BONUS_THRESHOLD), UPPER_BONUS, 0)
+
+        # For each stage: the actions of its states, and the successors of its non-final actions
+        self._stages = []
+        for stage in compiled.stages[1:]:
+            actions = np.concatenate([compiled.get_actions(state) for state in stage])
+            offsets = np.concatenate(([0], np.cumsum(compiled.n_actions_per_state[stage])[:-1]))
+            actions_to_solve = actions[~np.isin(actions, self._final_actions)]
+            afterstates, action_afterstates = np.unique(compiled.action_afterstates[actions_to_solve],
+                                                        return_inverse=True)
+            starts, ends = compiled.afterstate_ptr[afterstates], compiled.afterstate_ptr[afterstates + 1]
+            successors = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)]
+                                        + [np.zeros(0, dtype=np.int64)])
+            self._stages.append((stage, actions, offsets, actions_to_solve, action_afterstates,
+                                 compiled.afterstate_states[successors], compiled.afterstate_probabilities[successors],
+                                 np.concatenate(([0], np.cumsum(ends - starts)[:-1]))))
+
+        self.values = None
+        self._turns = {}
+
+    def _final_values(self, mask, upper_totals=None):
+        """Value of each final choice (reward and value of the next scorecard) for each upper subtotal."""
+        if upper_totals is None:
+            upper_totals = np.arange(UPPER_BONUS_THRESHOLD + 1)
+        next_scorecards = ((mask | self._category_bits) * (UPPER_BONUS_THRESHOLD + 1) +
+                           self._next_upper_totals[upper_totals])
+        output = self._final_rewards[upper_totals] + self.values[next_scorecards]
+        output[:, (mask & self._category_bits) > 0] = -np.inf
+        return output
+
+    def _solve_turns(self, final_values):
+        """
+        Solve a batch of turns by backward induction, given the value of the final choices of each one.
+
+        :return: A tuple of arrays (state values, action values) of shape (n_turns, n_states) and (n_turns, n_actions)
+        """
+        # The turns are the last axis while solving, so that the reductions run over contiguous rows
+        compiled = self.compiled
+        state_values = np.zeros((compiled.n_states, len(final_values)))
+        action_values = np.zeros((compiled.n_actions, len(final_values)))
+        action_values[self._final_actions] = final_values.T
+
+        for (stage, actions, offsets, actions_to_solve, action_afterstates,
+             successor_states, successor_probabilities, successor_offsets) in self._stages:
+            if len(actions_to_solve):
+                afterstate_values = np.add.reduceat(successor_probabilities[:, None] * state_values[successor_states],
+                                                    successor_offsets)
+                action_values[actions_to_solve] = (compiled.rewards[actions_to_solve, None] +
+                                                   afterstate_values[action_afterstates])
+            state_values[stage] = np.maximum.reduceat(action_values[actions], offsets)
+
+        state_values, action_values = state_values.T, action_values.T
+        return state_values, action_values
+
+    def solve(self):
+        """
+        Compute the optimal expected final score of every scorecard.
+
+        :return: An array of values indexed by the encoded scorecards
+        """
+        self.values = np.zeros(N_SCORECARDS)
+        initial_state = self._stages[-1][0][0]
+
+        # A scorecard only leads to scorecards with more used categories, i.e. greater masks
+        for mask in range(2 ** len(CATEGORIES) - 2, -1, -1):
+            state_values, _ = self._solve_turns(self._final_values(mask))
+            start = mask * (UPPER_BONUS_THRESHOLD + 1)
+            self.values[start:start + UPPER_BONUS_THRESHOLD + 1] = state_values[:, initial_state]
+
+        self._turns = {}
+        return self.values
+
+    def solve_turn(self, scorecard):
+        """
+        Return the optimal policy of a turn played with a given scorecard (memoized).
+
+        :param scorecard: The encoded scorecard (see `encode_scorecard`)
+
+        :return: A PolicyTables() on the compiled `Turn()`
+        """
+        if scorecard not in self._turns:
+            mask, upper_total = divmod(scorecard, UPPER_BONUS_THRESHOLD + 1)
+            state_values, action_values = self._solve_turns(self._final_values(mask, np.array([upper_total])))
+            self._turns[scorecard] = PolicyTables(self.compiled, state_values[0], action_values[0],
+                                                  greedy_probabilities(self.compiled, action_values[0]))
+        return self._turns[scorecard]
+
+    @property
+    def expected_score(self):
+        """The optimal expected final score of a game."""
+        return self.values[encode_scorecard()]
+
+
+def solve_game(turn=None, cache_dir=None):
+    """
+    Returns the solved full game, the values of the scorecards being loaded from (or saved to) the on-disk cache.
+
+    :param turn: The `Turn()` to solve the turns with (built if None)
+    :param cache_dir: The cache directory (`$YATHZEE_CACHE_DIR` or `~/.cache/yathzee` by default)
+
+    :return: A GameSolver()
+    """
+    solver = GameSolver(turn)
+
+    path = os.path.join(cache_dir or DEFAULT_CACHE_DIR, f'game-{get_cache_key(rules=solver.turn.rules)}.npy')
+    if os.path.isfile(path):
+        solver.values = np.load(path)
+    else:
+        solver.solve()
+        # Write in a temporary file first, so that a concurrent reader never loads a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy')
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, solver.values)
+        os.replace(tmp_path, path)
+
+    return solver
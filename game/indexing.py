@@ -0,0 +1,138 @@
+from functools import lru_cache
+from itertools import combinations_with_replacement
+from math import comb
+
+import numpy as np
+
+
+class HandIndex:
+    """
+    Dense index of the sorted hands of `n_dice` dice: each hand is ranked by its position in the
+    lexicographic order of the sorted hands, in O(n_dice) array lookups.
+    """
+
+    def __init__(self, n_dice, min_value=1, max_value=6):
+        self.n_dice = n_dice
+        self.min_value = min_value
+        self.max_value = max_value
+        self.n_faces = max_value - min_value + 1
+
+        # All the sorted hands, in the order of their rank
+        hands = list(combinations_with_replacement(range(min_value, max_value + 1), n_dice))
+        self.hands = np.array(hands, dtype=np.int64).reshape(len(hands), n_dice)
+
+        # _offsets[i, v]: number of sorted hands whose dice before `i` are fixed, and whose dice `i`
+        # is lower than the face `v` (counted from the face of the dice `i - 1`)
+        self._offsets = np.zeros((max(n_dice, 1), self.n_faces + 1), dtype=np.int64)
+        for i in range(n_dice):
+            n_remaining = n_dice - i - 1
+            for value in range(self.n_faces):
+                self._offsets[i, value + 1] = (self._offsets[i, value] +
+                                               comb(self.n_faces - value + n_remaining - 1, n_remaining))
+
+    def __len__(self):
+        return len(self.hands)
+
+    def rank(self, hands):
+        """
+        Return the rank of a batch of hands.
+
+        :param hands: Array of hands of shape (n_hands, n_dice), in any order of the dice
+
+        :return: An array of ranks
+        """
+        hands = np.asarray(hands, dtype=np.int64)
+        values = np.sort(hands.reshape(hands.size // max(self.n_dice, 1), self.n_dice), axis=1) - self.min_value
+        previous = np.concatenate((np.zeros((len(values), 1), dtype=np.int64), values[:, :-1]), axis=1)
+        dice = np.arange(self.n_dice)
+        return (self._offsets[dice, values] - self._offsets[dice, previous]).sum(axis=1)
+
+    def rank_one(self, hand):
+        """Return the rank of a single hand (sorted or not)."""
+        rank = 0
+        previous = 0
+        for i, value in enumerate(sorted(hand)):
+            value -= self.min_value
+            rank += self._offsets[i, value] - self._offsets[i, previous]
+            previous = value
+        return int(rank)
+
+    def counts(self, hands=None):
+        """
+        Return the canonical dice-count (histogram) encoding of a batch of hands.
+
+        :param hands: Array of hands of shape (n_hands, n_dice), all the ranked hands if None
+
+        :return: An array of shape (n_hands, n_faces), the number of dice showing each face
+        """
+        hands = self.hands if hands is None else np.asarray(hands).reshape(-1, self.n_dice)
+        faces = np.arange(self.min_value, self.max_value + 1)
+        return (hands[:, :, None] == faces).sum(axis=1)
+
+
+@lru_cache(maxsize=None)
+def get_hand_index(n_dice, min_value=1, max_value=6):
+    """
+    Returns the (shared) HandIndex() of the hands of a given number of dice.
+
+    :param n_dice: The number of dice
+    :param min_value: The minimum value of the dice
+    :param max_value: The maximum value of the dice
+
+    :return: A HandIndex()
+    """
+    return HandIndex(n_dice, min_value, max_value)
+
+
+class KeepIndex:
+    """
+    Index of all the distinct sets of dice which can be kept from the hands of `n_dice` dice (from 0 to
+    `n_dice` dice), with a sparse (CSR) incidence structure from each hand to the keeps it contains.
+
+    The keeps are ordered by their number of dice, then by their rank in the HandIndex() of that number of dice.
+    """
+
+    def __init__(self, n_dice, min_value=1, max_value=6):
+        self.n_dice = n_dice
+        self.hand_index = get_hand_index(n_dice, min_value, max_value)
+
+        keep_indexes = [get_hand_index(n_keep, min_value, max_value) for n_keep in range(n_dice + 1)]
+        self.offsets = np.cumsum([0] + [len(index) for index in keep_indexes])
+        self.keeps = [tuple(keep) for index in keep_indexes for keep in index.hands.tolist()]
+        self.n_keep = np.repeat(np.arange(n_dice + 1), [len(index) for index in keep_indexes])
+
+        # A hand contains a keep if it has at least as many dice of each face (compared face by face, so that
+        # the incidence matrix stays of shape (n_hands, n_keeps) with many dice or faces)
+        keep_counts = np.concatenate([index.counts() for index in keep_indexes])
+        hand_counts = self.hand_index.counts()
+        incidence = np.ones((len(hand_counts), len(keep_counts)), dtype=bool)
+        for face in range(hand_counts.shape[1]):
+            incidence &= hand_counts[:, face, None] >= keep_counts[None, :, face]
+        hands, self.indices = np.nonzero(incidence)
+        self.ptr = np.concatenate(([0], np.cumsum(np.bincount(hands, minlength=len(self.hand_index)))))
+
+    def __len__(self):
+        return len(self.keeps)
+
+    def get_keeps(self, hand_rank):
+        """Return the ids of the keeps contained in a hand, given by its rank."""
+        return self.indices[self.ptr[hand_rank]:self.ptr[hand_rank + 1]]
+
+    def rank(self, keeps):
+        """Return the id of a single keep (sorted or not)."""
+        return int(self.offsets[len(keeps)]) + get_hand_index(len(keeps), self.hand_index.min_value,
+                                                              self.hand_index.max_value).rank_one(keeps)
+
+
+@lru_cache(maxsize=None)
+def get_keep_index(n_dice, min_value=1, max_value=6):
+    """
+    Returns the (shared) KeepIndex() of the hands of a given number of dice.
+
+    :param n_dice: The number of dice
+    :param min_value: The minimum value of the dice
+    :param max_value: The maximum value of the dice
+
+    :return: A KeepIndex()
+    """
+    return KeepIndex(n_dice, min_value, max_value)
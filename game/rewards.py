@@ -1,6 +1,10 @@
+from functools import lru_cache
+
 import numpy as np
 
 from game import components
+from game.indexing import get_hand_index
+from game.rules import DEFAULT_RULES, get_categories
 
 __all__ = [
     'check_unique_value',
@@ -8,9 +12,15 @@ __all__ = [
     'check_full',
     'check_straight',
     'check_yathzee',
-    'check_chance'
+    'check_chance',
+    'CATEGORIES',
+    'score_hands',
+    'get_reward_matrix',
 ]
 
+# Scoring categories, in the order of the final choices
+CATEGORIES = get_categories(1, 6)
+
 
 def check_unique_value(combination):
     array = np.asarray(combination)
@@ -81,6 +91,63 @@ def check_chance(combination):
                                    reward=np.sum(array))]
 
 
+def score_hands(hands, min_value=1, max_value=6, categories=None):
+    """
+    Score a batch of hands in every category at once.
+
+    :param hands: Array of hands of shape (n_hands, n_dice)
+    :param min_value: The minimum value of the dice
+    :param max_value: The maximum value of the dice
+    :param categories: The names of the categories to score (all of them by default, see `get_categories`)
+
+    :return: An array of rewards of shape (n_hands, len(categories))
+    """
+    hands = np.asarray(hands, dtype=np.int64)
+    hands = hands.reshape(-1, hands.shape[-1])
+    faces = np.arange(min_value, max_value + 1)
+    counts = (hands[:, :, None] == faces).sum(axis=1)
+    present = counts > 0
+
+    total = hands.sum(axis=1)
+    n_distinct = present.sum(axis=1)
+    min_count = np.where(present, counts, hands.shape[1]).min(axis=1)
+
+    def straight(length):
+        windows = [present[:, start:start + length].all(axis=1) for start in range(len(faces) - length + 1)]
+        return np.any(windows, axis=0) if windows else np.zeros(len(hands), dtype=bool)
+
+    columns = dict(zip(get_categories(min_value, max_value), (counts * faces).T))
+    columns.update({
+        'Kind_3': np.where(counts.max(axis=1) >= 3, total, 0),
+        'Kind_4': np.where(counts.max(axis=1) >= 4, total, 0),
+        'Full': np.where((n_distinct == 2) & (min_count > 1), 25, 0),
+        'Small_Straight': np.where(straight(4), 30, 0),
+        'Large_Straight': np.where(straight(5), 40, 0),
+        'Yathzee': np.where(n_distinct == 1, 50, 0),
+        'Chance': total,
+    })
+
+    if categories is None:
+        categories = get_categories(min_value, max_value)
+    return np.column_stack([columns[category] for category in categories]).reshape(len(hands), len(categories))
+
+
+@lru_cache(maxsize=None)
+def get_reward_matrix(rules=DEFAULT_RULES):
+    """
+    Returns the (cached, read-only) rewards of the sorted hands in every category of the rules.
+
+    :param rules: The Rules() of the turn
+
+    :return: An array of shape (n_hands, len(rules.categories)), the rows being ordered by the rank of the
+    hands (see `HandIndex`); (252, 13) with the default rules
+    """
+    hands = get_hand_index(rules.n_dice, rules.min_value, rules.max_value).hands
+    matrix = score_hands(hands, rules.min_value, rules.max_value, rules.categories)
+    matrix.flags.writeable = False
+    return matrix
+
+
 if __name__ == '__main__':
 
     from game.components import Combination
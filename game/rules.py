@@ -0,0 +1,81 @@
+def get_categories(min_value=1, max_value=6):
+    """
+    Returns the names of all the scoring categories of dice with the given faces.
+
+    :param min_value: The minimum value of the dice
+    :param max_value: The maximum value of the dice
+
+    :return: A list of str
+    """
+    return [f'Count_{value}' for value in range(min_value, max_value + 1)] + [
+        'Kind_3', 'Kind_4', 'Full', 'Small_Straight', 'Large_Straight', 'Yathzee', 'Chance'
+    ]
+
+
+class Rules:
+    """
+    Rules of a turn: `n_dice` dice with faces `min_value` to `max_value`, rolled at most `n_rolls` times,
+    the final hand being scored in one of the `categories`.
+
+    The steps of a turn are then the initial state (0), the rolls (1 to `n_rolls`) and the final state
+    (`n_rolls + 1`).
+    """
+
+    def __init__(self, n_dice=5, min_value=1, max_value=6, n_rolls=3, categories=None):
+        """
+        :param n_dice: The number of dice
+        :param min_value: The minimum value of the dice
+        :param max_value: The maximum value of the dice
+        :param n_rolls: The maximum number of rolls in a turn
+        :param categories: The names of the scoring categories (all of `get_categories()` if None)
+        """
+        if n_dice < 1 or n_rolls < 1 or max_value < min_value:
+            raise ValueError(f'Invalid rules: {n_dice} dice, faces {min_value} to {max_value}, {n_rolls} rolls.')
+
+        all_categories = get_categories(min_value, max_value)
+        if categories is None:
+            categories = all_categories
+        unknown = [category for category in categories if category not in all_categories]
+        if unknown:
+            raise ValueError(f"'categories' must be among {all_categories}: {unknown} have been given.")
+
+        self.n_dice = n_dice
+        self.min_value = min_value
+        self.max_value = max_value
+        self.n_rolls = n_rolls
+        self.categories = tuple(categories)
+
+    def __repr__(self):
+        return 'Rules({})'.format(', '.join(f'{key}={value!r}' for key, value in self.as_dict().items()))
+
+    def __eq__(self, other):
+        return isinstance(other, Rules) and self.as_dict() == other.as_dict()
+
+    def __hash__(self):
+        return hash((self.n_dice, self.min_value, self.max_value, self.n_rolls, self.categories))
+
+    @property
+    def n_faces(self):
+        return self.max_value - self.min_value + 1
+
+    @property
+    def final_step(self):
+        """The step of the last roll, where the hand is scored."""
+        return self.n_rolls
+
+    @property
+    def terminal_step(self):
+        return self.n_rolls + 1
+
+    def as_dict(self):
+        """Return the rules as a JSON-serializable dict."""
+        return {
+            'n_dice': self.n_dice,
+            'min_value': self.min_value,
+            'max_value': self.max_value,
+            'n_rolls': self.n_rolls,
+            'categories': list(self.categories),
+        }
+
+
+DEFAULT_RULES = Rules()
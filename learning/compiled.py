@@ -0,0 +1,310 @@
+import json
+import os
+import shutil
+import tempfile
+from functools import partial
+
+import numpy as np
+
+from learning.utils import SegmentSampler
+
+# Arrays of a CompiledPolicy() saved on disk, one `.npy` file each
+_ARRAYS = ('is_terminal', 'action_ptr', 'rewards', 'probabilities', 'action_afterstates',
+           'afterstate_ptr', 'afterstate_states', 'afterstate_probabilities')
+
+
+class CompiledPolicy:
+    """
+    Flat array form of a Policy.
+
+    States and actions are numbered with dense integer ids (in the order of `policy.states` and
+    `state.actions`). The actions of state `s` are `action_ptr[s]:action_ptr[s + 1]`.
+
+    The actions sharing the same list of next states (e.g. the choices keeping the same dice at the same
+    step) share the same afterstate `action_afterstates[a]`. The successors of afterstate `k` are stored as a
+    CSR matrix: `afterstate_states[afterstate_ptr[k]:afterstate_ptr[k + 1]]` with the matching transition
+    probabilities in `afterstate_probabilities`. The same matrix indexed by action is available as
+    `successor_ptr`, `successor_states` and `successor_probabilities`.
+    """
+
+    def __init__(self, state_ids, action_ids, is_terminal, action_ptr, rewards, probabilities,
+                 action_afterstates, afterstate_ptr, afterstate_states, afterstate_probabilities, ids_loader=None):
+        # The ids can be read lazily with `ids_loader()`, which returns the tuple (state_ids, action_ids)
+        self._state_ids = state_ids
+        self._action_ids = action_ids
+        self._ids_loader = ids_loader
+        self.is_terminal = is_terminal
+        self.action_ptr = action_ptr
+        self.rewards = rewards
+        self.probabilities = probabilities
+        self.action_afterstates = action_afterstates
+        self.afterstate_ptr = afterstate_ptr
+        self.afterstate_states = afterstate_states
+        self.afterstate_probabilities = afterstate_probabilities
+
+        self.n_actions_per_state = np.diff(action_ptr)
+        self.action_states = np.repeat(np.arange(self.n_states), self.n_actions_per_state)
+        self._state_index = None
+        self._action_index = None
+        self._stages = None
+        self._successor_sampler = None
+        self._successors = None
+        self._predecessors = None
+
+    @property
+    def n_states(self):
+        return len(self.is_terminal)
+
+    @property
+    def n_actions(self):
+        return len(self.rewards)
+
+    @property
+    def n_afterstates(self):
+        return len(self.afterstate_ptr) - 1
+
+    @property
+    def successor_ptr(self):
+        return self._get_successors()[0]
+
+    @property
+    def successor_states(self):
+        return self._get_successors()[1]
+
+    @property
+    def successor_probabilities(self):
+        return self._get_successors()[2]
+
+    def _get_successors(self):
+        """Expand (once) the successors of the afterstates into a CSR matrix indexed by action."""
+        if self._successors is None:
+            n_successors = np.diff(self.afterstate_ptr)[self.action_afterstates]
+            starts = np.repeat(self.afterstate_ptr[:-1][self.action_afterstates], n_successors)
+            offsets = np.arange(n_successors.sum()) - np.repeat(np.cumsum(n_successors) - n_successors, n_successors)
+            self._successors = (np.concatenate(([0], np.cumsum(n_successors))).astype(np.int64),
+                                self.afterstate_states[starts + offsets],
+                                self.afterstate_probabilities[starts + offsets])
+        return self._successors
+
+    def _get_predecessors(self):
+        """Transpose (once) the successors of the afterstates into a CSR matrix indexed by next state."""
+        if self._predecessors is None:
+            order = np.argsort(self.afterstate_states, kind='stable')
+            afterstates = np.repeat(np.arange(self.n_afterstates), np.diff(self.afterstate_ptr))
+            n_predecessors = np.bincount(self.afterstate_states, minlength=self.n_states)
+            self._predecessors = (np.concatenate(([0], np.cumsum(n_predecessors))).astype(np.int64),
+                                  afterstates[order], self.afterstate_probabilities[order])
+        return self._predecessors
+
+    @property
+    def state_ids(self):
+        """The `State.id` of each state."""
+        if self._state_ids is None:
+            self._state_ids, self._action_ids = self._ids_loader()
+        return self._state_ids
+
+    @property
+    def action_ids(self):
+        """The pair (`State.id`, `Action.id`) of each action."""
+        if self._action_ids is None:
+            self._state_ids, self._action_ids = self._ids_loader()
+        return self._action_ids
+
+    @property
+    def state_index(self):
+        """Map each `State.id` to its integer id."""
+        if self._state_index is None:
+            self._state_index = {state_id: i for i, state_id in enumerate(self.state_ids)}
+        return self._state_index
+
+    @property
+    def action_index(self):
+        """Map each `(State.id, Action.id)` pair to its integer id."""
+        if self._action_index is None:
+            self._action_index = {action_id: i for i, action_id in enumerate(self.action_ids)}
+        return self._action_index
+
+    def sample_successors(self, actions, rng):
+        """Draw the next state of many actions at once."""
+        indices = self._get_successor_sampler()(self.action_afterstates[actions], rng)
+        return self.afterstate_states[indices]
+
+    def sample_successor(self, action, rng):
+        """Draw the next state of a single action."""
+        return self.afterstate_states[self._get_successor_sampler().sample(self.action_afterstates[action], rng)]
+
+    def _get_successor_sampler(self):
+        if self._successor_sampler is None:
+            self._successor_sampler = SegmentSampler(self.afterstate_ptr, self.afterstate_probabilities)
+        return self._successor_sampler
+
+    @property
+    def stages(self):
+        """
+        Group the states by their distance to the end of an episode: `stages[0]` holds the states
+        without actions, and the successors of a state of `stages[k]` all belong to earlier stages.
+        """
+        if self._stages is None:
+            self._stages = self._get_stages()
+        return self._stages
+
+    def _get_stages(self):
+        has_successors = np.diff(self.afterstate_ptr) > 0
+        heights = np.zeros(self.n_states, dtype=np.int64)
+        for _ in range(self.n_states):
+            afterstate_heights = np.zeros(self.n_afterstates, dtype=np.int64)
+            afterstate_heights[has_successors] = np.maximum.reduceat(
+                heights[self.afterstate_states], self.afterstate_ptr[:-1][has_successors])
+            new_heights = np.zeros(self.n_states, dtype=np.int64)
+            np.maximum.at(new_heights, self.action_states, afterstate_heights[self.action_afterstates] + 1)
+            if np.array_equal(new_heights, heights):
+                return [np.flatnonzero(heights == height) for height in range(heights.max() + 1)]
+            heights = new_heights
+
+        raise ValueError('The policy contains cycles, its states cannot be ordered in stages.')
+
+    def afterstate_values(self, state_values):
+        """Return, for every afterstate, the expected value of its next states."""
+        output = np.zeros(self.n_afterstates)
+        has_successors = np.diff(self.afterstate_ptr) > 0
+        output[has_successors] = np.add.reduceat(
+            self.afterstate_probabilities * state_values[self.afterstate_states],
+            self.afterstate_ptr[:-1][has_successors])
+        return output
+
+    def expected_values(self, state_values):
+        """Return, for every action, the expected value of its next states."""
+        return self.afterstate_values(state_values)[self.action_afterstates]
+
+    def get_actions(self, state):
+        """Return the integer ids of the actions of a given (integer) state."""
+        return np.arange(self.action_ptr[state], self.action_ptr[state + 1])
+
+    def get_successors(self, action):
+        """Return the successor states of a given (integer) action and their probabilities."""
+        afterstate = self.action_afterstates[action]
+        start, stop = self.afterstate_ptr[afterstate], self.afterstate_ptr[afterstate + 1]
+        return self.afterstate_states[start:stop], self.afterstate_probabilities[start:stop]
+
+    def get_predecessors(self, state):
+        """Return the afterstates leading to a given (integer) state, and their probabilities of leading to it."""
+        ptr, afterstates, probabilities = self._get_predecessors()
+        return afterstates[ptr[state]:ptr[state + 1]], probabilities[ptr[state]:ptr[state + 1]]
+
+
+def compile_policy(policy):
+    """
+    Compile a built policy (e.g. `Turn()`) into a CompiledPolicy.
+
+    :param policy: The policy to compile, its actions must be linked to their next states
+
+    :return: A CompiledPolicy()
+    """
+    states = policy.states
+    state_index = {state.id: i for i, state in enumerate(states)}
+
+    action_ids = []
+    n_actions = [0] * len(states)
+    rewards = []
+    probabilities = []
+    action_afterstates = []
+
+    # The actions sharing the same list of next states (the same object) share the same afterstate
+    afterstates = {}
+    n_successors = []
+    successor_states = []
+    successor_probabilities = []
+    for i, state in enumerate(states):
+        n_actions[i] = len(state.actions)
+        for action in state.actions:
+            action_ids.append((state.id, action.id))
+            rewards.append(action.reward)
+            probabilities.append(action.probability)
+
+            to_states = action.to_states
+            afterstate = afterstates.get(id(to_states))
+            if afterstate is None:
+                afterstate = afterstates[id(to_states)] = len(n_successors)
+
+                weights = to_states.weights
+                if weights is NotImplemented or len(weights) != len(to_states):
+                    weights = [1 / len(to_states)] * len(to_states) if to_states else []
+                n_successors.append(len(to_states))
+                successor_states += [state_index[next_state.id] for next_state in to_states]
+                successor_probabilities += weights
+            action_afterstates.append(afterstate)
+
+    return CompiledPolicy(
+        state_ids=[state.id for state in states],
+        action_ids=action_ids,
+        is_terminal=np.array([state.is_terminal for state in states], dtype=bool),
+        action_ptr=np.concatenate(([0], np.cumsum(n_actions))).astype(np.int64),
+        rewards=np.array(rewards, dtype=float),
+        probabilities=np.array(probabilities, dtype=float),
+        action_afterstates=np.array(action_afterstates, dtype=np.int64),
+        afterstate_ptr=np.concatenate(([0], np.cumsum(n_successors))).astype(np.int64),
+        afterstate_states=np.array(successor_states, dtype=np.int64),
+        afterstate_probabilities=np.array(successor_probabilities, dtype=float),
+    )
+
+
+def _to_tuple(value):
+    """Convert back the (nested) lists decoded from JSON into tuples."""
+    if isinstance(value, list):
+        return tuple(_to_tuple(item) for item in value)
+    return value
+
+
+def save_compiled(compiled, path, metadata=None):
+    """
+    Save a CompiledPolicy() in a directory: one `.npy` file per array (so that they can be memory-mapped),
+    and the state and action ids in a JSON file (only read when they are first needed).
+
+    :param compiled: The CompiledPolicy() to save
+    :param path: The directory to create (kept as is if it already exists)
+    :param metadata: A JSON-serializable dict stored alongside the arrays (optional)
+
+    :return: True if the policy has been saved, False if `path` was already saved (e.g. by a concurrent process)
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+
+    # Write in a temporary directory first, so that a reader never sees a partial cache
+    tmp_path = tempfile.mkdtemp(dir=parent)
+    for name in _ARRAYS:
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(getattr(compiled, name)))
+    with open(os.path.join(tmp_path, 'ids.json'), 'w') as file:
+        json.dump({'state_ids': compiled.state_ids, 'action_ids': compiled.action_ids,
+                   'metadata': metadata or {}}, file)
+
+    # A saved directory is never deleted, since it may be read by another process: the first writer wins
+    # (`os.replace` fails on a non-empty directory), and the others only delete their own temporary directory
+    try:
+        os.replace(tmp_path, path)
+        return True
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+        return False
+
+
+def load_compiled(path, mmap_mode='r'):
+    """
+    Load a CompiledPolicy() saved with `save_compiled`.
+
+    :param path: The directory of the saved policy
+    :param mmap_mode: Memory-map mode of the arrays (see `numpy.load`), None to read them in memory
+
+    :return: A CompiledPolicy()
+    """
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in _ARRAYS}
+    return CompiledPolicy(state_ids=None, action_ids=None, ids_loader=partial(_load_ids, path), **arrays)
+
+
+def _load_ids(path):
+    """Read the state and action ids saved with `save_compiled`."""
+    with open(os.path.join(path, 'ids.json')) as file:
+        ids = json.load(file)
+    return ([_to_tuple(state_id) for state_id in ids['state_ids']],
+            [_to_tuple(action_id) for action_id in ids['action_ids']])
@@ -1,8 +1,14 @@
+import numpy as np
 from numpy.random import random
-from random import choices
+from random import random as random_uniform
+
+from learning.compiled import compile_policy
+from learning.utils import AliasTable
 
 
 class ValueFunction:
+    # Empty slots, so that the subclasses can be slotted (e.g. the actions) or not (e.g. the tuple states)
+    __slots__ = ()
 
     def __init__(self):
         self._value_function = 0.
@@ -17,6 +23,7 @@ class ValueFunction:
 
 
 class State(ValueFunction):
+    __slots__ = ()
 
     def __init__(self, is_terminal=False):
         super().__init__()
@@ -46,6 +53,8 @@ class State(ValueFunction):
 
 
 class Action(ValueFunction):
+    # The actions are by far the most numerous objects of an environment: no `__dict__`
+    __slots__ = ('_value_function', '_action', '_from_state', '_probability', '_to_states')
 
     def __init__(self, from_state=None, probability=None):
         super().__init__()
@@ -55,9 +64,7 @@ class Action(ValueFunction):
         self._to_states = StatesList()   # []
 
     def __call__(self, use_weights=False):
-        if use_weights:
-            return choices(self.to_states, self.to_states.weights)[0]
-        return choices(self.to_states)[0]
+        return self.to_states.sample(use_weights)
 
     # def populate_prev(self, state):
     #     """Assign previous state to self._from_state"""
@@ -83,6 +90,8 @@ class Action(ValueFunction):
     @probability.setter
     def probability(self, value):
         self._probability = value
+        if self._from_state is not None:
+            self._from_state._actions.reset_sampler()
 
     @property
     def to_states(self):
@@ -94,9 +103,23 @@ class Action(ValueFunction):
 
 
 class StatesList(list):
+    __slots__ = ('_sampler',)
 
     def __init__(self, *args):
         list.__init__(self, *args)
+        self._sampler = None
+
+    def sample(self, use_weights=False):
+        """Draw a state, uniformly or with the weights of the list (its sampling table is built once)."""
+        if not use_weights:
+            return self[int(random_uniform() * len(self))]
+        if self._sampler is None:
+            self._sampler = AliasTable(self.weights)
+        return self[self._sampler.sample()]
+
+    def reset_sampler(self):
+        """Forget the sampling table (to call when the weights change)."""
+        self._sampler = None
 
     @property
     def weights(self):
@@ -108,9 +131,25 @@ class StatesList(list):
 
 
 class ActionsList(list):
+    __slots__ = ('_sampler',)
 
     def __init__(self, *args):
         list.__init__(self, *args)
+        self._sampler = None
+
+    def sample(self, use_policy=False):
+        """
+        Draw an action, uniformly or following the probabilities of the policy. The sampling table of
+        the probabilities is built once, and rebuilt only after one of them changes.
+        """
+        if not use_policy:
+            return self[int(random_uniform() * len(self))]
+        if self._sampler is None:
+            self._sampler = AliasTable(self.probabilities)
+        return self[self._sampler.sample()]
+
+    def reset_sampler(self):
+        self._sampler = None
 
     def init_probabilities(self, method='uniform'):
         if len(self) == 0:
@@ -140,6 +179,7 @@ class Policy:
         self._states = NotImplemented  # List
         self.__states_architecture = NotImplemented  # Custom architecture
         self._init_policy = NotImplemented
+        self._compiled = None
 
         self._check_init_policy(init_policy)
 
@@ -153,11 +193,25 @@ class Policy:
 
     def execute(self):
         """Links each state to their next states."""
+        self._compiled = None
         for state in self.states:
             for action in state.actions:
                 action.populate_next(self)
             state.actions.init_probabilities(self.init_policy)
 
+    def compile(self):
+        """
+        Return the flat array form (CompiledPolicy) of the policy, compiled once and shared. Its probabilities
+        are read again from the actions at each call, since they may have changed since (e.g. with
+        `PolicyTables.apply` or by setting `action.probability`).
+        """
+        if self._compiled is None:
+            self._compiled = compile_policy(self)
+        else:
+            self._compiled.probabilities = np.array(
+                [action.probability for state in self.states for action in state.actions], dtype=float)
+        return self._compiled
+
     @property
     def states(self):
         """Return all states in a list."""
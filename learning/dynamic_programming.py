@@ -0,0 +1,116 @@
+import numpy as np
+
+from learning.tables import PolicyTables, get_tables
+from learning.utils import greedy_probabilities
+
+
+def backward_induction(compiled, gamma=1.):
+    """
+    Compute the optimal value functions of a compiled policy without cycles (e.g. a turn), by
+    solving its stages from the end of the episode back to its beginning.
+
+    :param compiled: The CompiledPolicy() to solve
+    :param gamma: Reward reducer parameter
+
+    :return: A tuple of arrays (state values, action values, greedy action probabilities)
+    """
+    state_values = np.zeros(compiled.n_states)
+    action_values = np.zeros(compiled.n_actions)
+
+    for stage in compiled.stages[1:]:
+        actions = np.concatenate([compiled.get_actions(state) for state in stage])
+        action_values[actions] = compiled.rewards[actions] + gamma * compiled.expected_values(state_values)[actions]
+
+        offsets = np.concatenate(([0], np.cumsum(compiled.n_actions_per_state[stage])[:-1]))
+        state_values[stage] = np.maximum.reduceat(action_values[actions], offsets)
+
+    return state_values, action_values, greedy_probabilities(compiled, action_values)
+
+
+def value_iteration(policy, gamma=1.):
+    """
+    Solve exactly a policy without cycles (e.g. `Turn()`) by backward induction.
+
+    :param policy: The policy to solve (or its PolicyTables())
+    :param gamma: Reward reducer parameter
+
+    :return: A PolicyTables() with the optimal value functions and the greedy probabilities
+    """
+    compiled = policy.compiled if isinstance(policy, PolicyTables) else policy.compile()
+    return PolicyTables(compiled, *backward_induction(compiled, gamma))
+
+
+def policy_evaluation(compiled, probabilities=None, gamma=1., tol=1e-12, max_iter=100000):
+    """
+    Compute the exact value functions of a fixed (stochastic) policy. A policy without cycles is
+    solved by a single backward sweep over its stages, any other one by iterative sweeps over its
+    sparse transitions, until the values change by less than `tol`.
+
+    :param compiled: The CompiledPolicy() to evaluate
+    :param probabilities: The probability of each action (those of `compiled` by default)
+    :param gamma: Reward reducer parameter
+    :param tol: The largest change of the values between two sweeps to stop at (policies with cycles only)
+    :param max_iter: The maximum number of sweeps (policies with cycles only)
+
+    :return: A tuple of arrays (state values, action values)
+    """
+    if probabilities is None:
+        probabilities = compiled.probabilities
+
+    # The probabilities of the actions of each state must form a distribution
+    has_actions = compiled.n_actions_per_state > 0
+    sums = np.bincount(compiled.action_states, weights=probabilities, minlength=compiled.n_states)[has_actions]
+    if (probabilities < 0).any() or np.abs(sums - 1).max(initial=0) > 1e-6:
+        invalid = np.flatnonzero(has_actions)[np.abs(sums - 1) > 1e-6]
+        raise ValueError(f'The action probabilities of each state must be non-negative and sum to 1: '
+                         f'{len(invalid)} states (e.g. {invalid[:5].tolist()}) do not.')
+
+    try:
+        stages = compiled.stages
+    except ValueError:
+        stages = None
+
+    if stages is not None:
+        state_values = np.zeros(compiled.n_states)
+        for stage in stages[1:]:
+            actions = np.concatenate([compiled.get_actions(state) for state in stage])
+            action_values = compiled.rewards[actions] + gamma * compiled.expected_values(state_values)[actions]
+
+            offsets = np.concatenate(([0], np.cumsum(compiled.n_actions_per_state[stage])[:-1]))
+            state_values[stage] = np.add.reduceat(probabilities[actions] * action_values, offsets)
+    else:
+        # V = R + gamma * P V, with the expected rewards R and the transition matrix P of the policy, stored
+        # as its non-zero entries (from the state of each action to its successors) instead of a dense matrix
+        expected_rewards = np.bincount(compiled.action_states, weights=probabilities * compiled.rewards,
+                                       minlength=compiled.n_states)
+        n_successors = np.diff(compiled.successor_ptr)
+        rows = np.repeat(compiled.action_states, n_successors)
+        transitions = np.repeat(probabilities, n_successors) * compiled.successor_probabilities
+
+        state_values = np.zeros(compiled.n_states)
+        for _ in range(max_iter):
+            new_values = expected_rewards + gamma * np.bincount(
+                rows, weights=transitions * state_values[compiled.successor_states], minlength=compiled.n_states)
+            is_converged = np.abs(new_values - state_values).max() < tol
+            state_values = new_values
+            if is_converged:
+                break
+        else:
+            raise ValueError(f'The evaluation of the policy did not converge in {max_iter} sweeps: its episodes '
+                             f'may never end (with gamma = {gamma}).')
+
+    return state_values, compiled.rewards + gamma * compiled.expected_values(state_values)
+
+
+def evaluate_policy(policy, gamma=1.):
+    """
+    Evaluate exactly a fixed policy, instead of estimating its values by sampling (see `predictions`).
+
+    :param policy: The policy to evaluate (or its PolicyTables())
+    :param gamma: Reward reducer parameter
+
+    :return: A PolicyTables() with the value functions of the policy, and its probabilities
+    """
+    tables = get_tables(policy)
+    tables.state_values, tables.action_values = policy_evaluation(tables.compiled, tables.probabilities, gamma)
+    return tables
@@ -0,0 +1,161 @@
+import time
+
+import numpy as np
+
+from learning.utils import best_actions
+
+
+class EarlyStopping:
+    """
+    Criteria to stop a training before its `n_iter` iterations, checked every `window` iterations:
+        - `tol`: the largest absolute change of the learned values over the last window is below `tol`
+        - `n_stable`: the greedy policy did not change over the last `n_stable` windows
+        - `max_time`: the training ran for `max_time` seconds (checked after every iteration)
+    """
+
+    def __init__(self, tol=None, n_stable=None, max_time=None, window=1000):
+        self.tol = tol
+        self.n_stable = n_stable
+        self.max_time = max_time
+        self.window = window
+
+
+class TrainingMonitor:
+    """
+    Follow a training: report its metrics to a callback every `every` iterations (episodes), and
+    check its EarlyStopping() criteria.
+
+    The callback receives a dict with:
+        - `iteration`: the number of iterations done
+        - `wall_time`: the time elapsed since the beginning of the training (in seconds)
+        - `episodes_per_second`: the throughput since the previous report
+        - `mean_value_change`: the mean absolute change of the learned values since the previous report
+        - `policy_changes`: the number of states whose action probabilities changed since the previous report
+        - `states_visited`: the number of distinct states visited since the beginning of the training
+    """
+
+    def __init__(self, compiled, values, probabilities, callback=None, every=1000, stopping=None,
+                 greedy_values=None):
+        """
+        :param compiled: The CompiledPolicy() of the training
+        :param values: The array of values learned (updated in place by the algorithm)
+        :param probabilities: The array of action probabilities (updated in place by the algorithm)
+        :param callback: The function called with the metrics (optional)
+        :param every: The number of iterations between two reports
+        :param stopping: The EarlyStopping() criteria (optional)
+        :param greedy_values: A function returning the action values the greedy policy is defined by
+        (the learned values by default)
+        """
+        self.compiled = compiled
+        self.values = values
+        self.probabilities = probabilities
+        self.callback = callback
+        self.every = every
+        self.stopping = stopping
+        self.greedy_values = greedy_values or (lambda: values)
+
+        self.iteration = 0
+        self.stop_reason = None
+        self.visited = np.zeros(compiled.n_states, dtype=bool)
+        self._start = self._last_time = time.perf_counter()
+        self._last_iteration = 0
+        self._last_values = values.copy()
+        self._last_probabilities = probabilities.copy()
+
+        self._last_check = 0
+        self._check_values = values.copy()
+        self._greedy = None
+        self._n_stable = 0
+
+    def visit(self, states):
+        """Mark states (an id or an array of ids, the negative ones being ignored) as visited."""
+        if np.ndim(states):
+            states = states[states >= 0]
+        self.visited[states] = True
+
+    def step(self, n_iterations=1, states=None):
+        """
+        Count the iterations done (and the states they visited), report and check the stopping criteria if needed.
+
+        :return: True if the training should stop
+        """
+        if states is not None:
+            self.visit(states)
+        self.iteration += n_iterations
+        if self.callback is not None and self.iteration - self._last_iteration >= self.every:
+            self.report()
+        if self.stopping is not None:
+            self.stop_reason = self._check()
+        return self.stop_reason is not None
+
+    def _check(self):
+        """Return the stopping criterion met (if any)."""
+        stopping = self.stopping
+        if stopping.max_time is not None and time.perf_counter() - self._start >= stopping.max_time:
+            return 'max_time'
+        if self.iteration - self._last_check < stopping.window:
+            return None
+        self._last_check = self.iteration
+
+        if stopping.tol is not None:
+            is_converged = np.abs(self.values - self._check_values).max() < stopping.tol
+            self._check_values[:] = self.values
+            if is_converged:
+                return 'tol'
+
+        if stopping.n_stable is not None:
+            greedy = best_actions(self.compiled, self.greedy_values())
+            self._n_stable = self._n_stable + 1 if self._greedy is not None and (greedy == self._greedy).all() else 0
+            self._greedy = greedy
+            if self._n_stable >= stopping.n_stable:
+                return 'n_stable'
+
+        return None
+
+    def metrics(self):
+        """Return the current metrics, and start a new reporting period."""
+        now = time.perf_counter()
+        changed = self.probabilities != self._last_probabilities
+        metrics = {
+            'iteration': self.iteration,
+            'wall_time': now - self._start,
+            'episodes_per_second': (self.iteration - self._last_iteration) / max(now - self._last_time, 1e-12),
+            'mean_value_change': float(np.abs(self.values - self._last_values).mean()),
+            'policy_changes': len(np.unique(self.compiled.action_states[changed])),
+            'states_visited': int(self.visited.sum()),
+        }
+
+        self._last_time = now
+        self._last_iteration = self.iteration
+        self._last_values[:] = self.values
+        self._last_probabilities[:] = self.probabilities
+        return metrics
+
+    def report(self):
+        self.callback(self.metrics())
+
+    def close(self, tables):
+        """Report the last iterations (if they were not already reported), and record how the training stopped."""
+        if self.callback is not None and self.iteration > self._last_iteration:
+            self.report()
+        tables.stop_reason = self.stop_reason or 'n_iter'
+        tables.n_iter = self.iteration
+
+
+def get_monitor(tables, values, callback=None, every=1000, stopping=None, greedy_values=None):
+    """
+    Return a TrainingMonitor() of the training of `values` (an array of `tables`), or None
+    without callback nor stopping criteria (so that the algorithms skip the monitoring entirely).
+    """
+    if callback is None and stopping is None:
+        return None
+    return TrainingMonitor(tables.compiled, values, tables.probabilities, callback, every, stopping, greedy_values)
+
+
+def close_monitor(monitor, tables, n_iter):
+    """Record how a training stopped on its tables (after `n_iter` iterations if it was not monitored)."""
+    if monitor is not None:
+        monitor.close(tables)
+    else:
+        tables.stop_reason = 'n_iter'
+        tables.n_iter = n_iter
@@ -1,96 +1,117 @@
-from copy import deepcopy
 import numpy as np
 
-from learning.utils import generate_episode, select_random_state, g
-
-
-def predictions(policy, gamma=1, n_iter=100, first_visit=True):
-    policy = deepcopy(policy)
-
-    returns = {state.id: [] for state in policy.states}
-    for it in range(n_iter):
-        origin_state = select_random_state(policy.states)
-        episode = generate_episode(origin_state)
-
-        known_states = []
-        for t, (state, _) in enumerate(episode):
-            if state not in known_states:
-                known_states.append(state)
-            elif first_visit:
-                continue
-
-            returns[state.id].append(g(episode, t, gamma))
-            state.value_function = np.mean(returns[state.id])
-
-    return policy
-
-
-def exploring_starts(policy, gamma=1, n_iter=100):
-    policy = deepcopy(policy)
-
-    returns = {state.id: {action.id: [] for action in state.actions}
-               for state in policy.states}
-
-    for it in range(n_iter):
-        origin_state, origin_action = select_random_state(policy.states,
-                                                          select_action=True)
-
-        episode = generate_episode(origin_state, origin_action, use_policy=True)
-        known_pairs = []
-        for t, (state, action) in enumerate(episode):
-            if (state, action) in known_pairs:
-                continue
-            known_pairs.append((state, action))
-
-            returns[state.id][action.id].append(g(episode, t, gamma))
-            action.value_function = np.mean(returns[state.id][action.id])
-
-        known_states = []
-        for state, _ in episode:
-            if state in known_states:
-                continue
-            known_states.append(state)
-
-            actions = {action.id: action.value_function for action in state.actions}
-            best_actions = [key for key, value in actions.items() if value == max(actions.values())]
-            for action in state.actions:
-                action.probability = 1 / len(best_actions) if action.id in best_actions else 0
-
-    return policy
-
-
-def on_policy_control(policy, gamma=1., epsilon=.1, n_iter=100, first_visit=True):
-    policy = deepcopy(policy)
-
-    # policy.init_policy = init_policy
-    returns = {state.id: {action.id: [] for action in state.actions}
-               for state in policy.states}
-
-    for it in range(n_iter):
-        origin_state = select_random_state(policy.states)
-
-        episode = generate_episode(origin_state, use_policy=True)
-        known_pairs = []
-        for t, (state, action) in enumerate(episode):
-            if first_visit and (state, action) in known_pairs:
-                continue
-            known_pairs.append((state, action))
-
-            returns[state.id][action.id].append(g(episode, t, gamma))
-            action.value_function = np.mean(returns[state.id][action.id])
-
-        known_states = []
-        for state, _ in episode:
-            if state in known_states:
-                continue
-            known_states.append(state)
-
-            actions = {action.id: action.value_function for action in state.actions}
-            best_actions = [key for key, value in actions.items() if value == max(actions.values())]
-            for action in state.actions:
-                if action.id in best_actions:
-                    action.probability = 1 - epsilon + epsilon / len(actions)
-                else:
-                    action.probability = epsilon / len(actions)
-
-    return policy
+from learning.monitoring import get_monitor, close_monitor
+from learning.tables import get_tables
+from learning.utils import (generate_episodes, select_random_states, discounted_returns, first_visits,
+                            greedy_probabilities, epsilon_greedy_probabilities, RunningMean, SegmentSampler,
+                            segment_indices)
+
+
+def _generate_batches(compiled, n_iter, batch_size=1, select_action=False, use_policy=False,
+                      probabilities=None, rng=None, action_sampler=None):
+    """
+    Yield `n_iter` episodes starting from random states (or random state-action pairs), by batches
+    of `batch_size` episodes. The `probabilities` array (and the `action_sampler` built on it) is read
+    at each batch, so the changes made to it while consuming a batch only apply to the next one.
+    """
+    rng = np.random.default_rng(rng)
+
+    for start in range(0, n_iter, batch_size):
+        n_episodes = min(batch_size, n_iter - start)
+
+        origin_actions = None
+        if select_action:
+            _, origin_actions = select_random_states(compiled, n_episodes, select_action=True,
+                                                     probabilities=probabilities, rng=rng)
+        yield generate_episodes(compiled, n_episodes, origin_actions=origin_actions, use_policy=use_policy,
+                                probabilities=probabilities, rng=rng, action_sampler=action_sampler)
+
+
+def predictions(policy, gamma=1, n_iter=100, first_visit=True, batch_size=1, rng=None, return_statistics=False,
+                callback=None, callback_every=1000, stopping=None):
+    tables = get_tables(policy)
+    compiled = tables.compiled
+    action_sampler = SegmentSampler(compiled.action_ptr)
+    returns = RunningMean(compiled.n_states)
+    monitor = get_monitor(tables, tables.state_values, callback, callback_every, stopping,
+                          lambda: compiled.rewards + gamma * compiled.expected_values(tables.state_values))
+
+    for states, _, rewards in _generate_batches(compiled, n_iter, batch_size, rng=rng,
+                                                action_sampler=action_sampler):
+        visits = first_visits(states) if first_visit else states >= 0
+        updated = returns.update(states[visits], discounted_returns(rewards, gamma)[visits])
+
+        if monitor is not None:
+            tables.state_values[updated] = returns.means[updated]
+            if monitor.step(len(states), states):
+                break
+
+    tables.state_values[returns.visited] = returns.means[returns.visited]
+    close_monitor(monitor, tables, n_iter)
+
+    if return_statistics:
+        return tables, returns
+    return tables
+
+
+def exploring_starts(policy, gamma=1, n_iter=100, batch_size=1, rng=None, return_statistics=False,
+                     callback=None, callback_every=1000, stopping=None):
+    tables = get_tables(policy)
+    compiled = tables.compiled
+    action_values, probabilities = tables.action_values, tables.probabilities
+    action_sampler = SegmentSampler(compiled.action_ptr, probabilities)
+    returns = RunningMean(compiled.n_actions)
+    monitor = get_monitor(tables, action_values, callback, callback_every, stopping)
+
+    for states, actions, rewards in _generate_batches(compiled, n_iter, batch_size, select_action=True,
+                                                      use_policy=True, probabilities=probabilities, rng=rng,
+                                                      action_sampler=action_sampler):
+        visits = first_visits(actions)
+        updated = returns.update(actions[visits], discounted_returns(rewards, gamma)[visits])
+        action_values[updated] = returns.means[updated]
+
+        # Only the policy of the visited states can change
+        improved = np.unique(states[states >= 0])
+        probabilities[segment_indices(compiled.action_ptr, improved)] = greedy_probabilities(
+            compiled, action_values, states=improved)
+        action_sampler.update(probabilities, improved)
+
+        if monitor is not None and monitor.step(len(states), states):
+            break
+
+    close_monitor(monitor, tables, n_iter)
+
+    if return_statistics:
+        return tables, returns
+    return tables
+
+
+def on_policy_control(policy, gamma=1., epsilon=.1, n_iter=100, first_visit=True, batch_size=1, rng=None,
+                      return_statistics=False, callback=None, callback_every=1000, stopping=None):
+    tables = get_tables(policy)
+    compiled = tables.compiled
+    action_values, probabilities = tables.action_values, tables.probabilities
+    action_sampler = SegmentSampler(compiled.action_ptr, probabilities)
+    returns = RunningMean(compiled.n_actions)
+    monitor = get_monitor(tables, action_values, callback, callback_every, stopping)
+
+    for states, actions, rewards in _generate_batches(compiled, n_iter, batch_size, use_policy=True,
+                                                      probabilities=probabilities, rng=rng,
+                                                      action_sampler=action_sampler):
+        visits = first_visits(actions) if first_visit else actions >= 0
+        updated = returns.update(actions[visits], discounted_returns(rewards, gamma)[visits])
+        action_values[updated] = returns.means[updated]
+
+        improved = np.unique(states[states >= 0])
+        probabilities[segment_indices(compiled.action_ptr, improved)] = epsilon_greedy_probabilities(
+            compiled, action_values, epsilon, states=improved)
+        action_sampler.update(probabilities, improved)
+
+        if monitor is not None and monitor.step(len(states), states):
+            break
+
+    close_monitor(monitor, tables, n_iter)
+
+    if return_statistics:
+        return tables, returns
+    return tables
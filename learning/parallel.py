@@ -0,0 +1,97 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+
+import numpy as np
+
+from learning.monte_carlo import predictions, on_policy_control
+from learning.tables import get_tables
+from learning.utils import epsilon_greedy_probabilities, segment_indices
+
+
+def _split_iterations(n_iter, n_jobs):
+    """Split `n_iter` iterations in `n_jobs` chunks of (almost) equal sizes."""
+    return [n_iter // n_jobs + (1 if job < n_iter % n_jobs else 0) for job in range(n_jobs)]
+
+
+def _run_workers(function, tables, n_iter, n_jobs, seed, **kwargs):
+    """
+    Run `function` on `n_jobs` processes, each one with its part of the iterations and its own
+    random stream, and merge the return statistics of the workers (the total number of iterations
+    they ran and the reason they stopped are recorded on `tables`).
+    """
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+
+    seeds = np.random.SeedSequence(seed).spawn(n_jobs)
+    with ProcessPoolExecutor(n_jobs) as executor:
+        futures = [executor.submit(function, tables, n_iter=job_iter, rng=job_seed, return_statistics=True, **kwargs)
+                   for job_iter, job_seed in zip(_split_iterations(n_iter, n_jobs), seeds)]
+        results = [future.result() for future in futures]
+
+    tables.n_iter = sum(job_tables.n_iter for job_tables, _ in results)
+    tables.stop_reason = next((job_tables.stop_reason for job_tables, _ in results
+                               if job_tables.stop_reason != 'n_iter'), 'n_iter')
+    statistics = [job_statistics for _, job_statistics in results]
+    return reduce(lambda merged, other: merged.merge(other), statistics)
+
+
+def parallel_predictions(policy, gamma=1, n_iter=100, first_visit=True, batch_size=1, n_jobs=None, seed=None,
+                         stopping=None):
+    """
+    Run `predictions` over a pool of processes.
+
+    :param policy: The policy to evaluate (or its PolicyTables())
+    :param n_jobs: Number of processes (all the CPUs by default)
+    :param seed: Seed of the random streams of the workers
+    :param stopping: EarlyStopping() criteria, checked by each worker on its own iterations
+
+    :return: A PolicyTables()
+    """
+    tables = get_tables(policy)
+    returns = _run_workers(predictions, tables, n_iter, n_jobs, seed,
+                           gamma=gamma, first_visit=first_visit, batch_size=batch_size, stopping=stopping)
+
+    tables.state_values[returns.visited] = returns.means[returns.visited]
+    return tables
+
+
+def parallel_on_policy_control(policy, gamma=1., epsilon=.1, n_iter=100, first_visit=True, batch_size=1,
+                               n_jobs=None, seed=None, stopping=None):
+    """
+    Run `on_policy_control` over a pool of processes. Each worker improves its own copy of the
+    policy, then the action values are merged and the epsilon-greedy policy is derived from them.
+
+    :param policy: The policy to improve (or its PolicyTables())
+    :param n_jobs: Number of processes (all the CPUs by default)
+    :param seed: Seed of the random streams of the workers
+    :param stopping: EarlyStopping() criteria, checked by each worker on its own iterations
+
+    :return: A PolicyTables()
+    """
+    tables = get_tables(policy)
+    returns = _run_workers(on_policy_control, tables, n_iter, n_jobs, seed, gamma=gamma, epsilon=epsilon,
+                           first_visit=first_visit, batch_size=batch_size, stopping=stopping)
+
+    compiled = tables.compiled
+    tables.action_values[returns.visited] = returns.means[returns.visited]
+
+    # Improve the policy on the states whose actions have been visited by any worker
+    improved = np.unique(compiled.action_states[returns.visited])
+    tables.probabilities[segment_indices(compiled.action_ptr, improved)] = epsilon_greedy_probabilities(
+        compiled, tables.action_values, epsilon, states=improved)
+    return tables
+
+
+def run_concurrently(tasks, n_jobs=None):
+    """
+    Run independent algorithms concurrently, each one in its own process.
+
+    :param tasks: List of tuple (function, args, kwargs), e.g. `(td0, (tables,), {'n_iter': 1000})`
+    :param n_jobs: Number of processes (all the CPUs by default)
+
+    :return: The list of the results, in the order of the tasks
+    """
+    with ProcessPoolExecutor(n_jobs) as executor:
+        futures = [executor.submit(function, *args, **kwargs) for function, args, kwargs in tasks]
+        return [future.result() for future in futures]
@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from learning.compiled import _to_tuple
+from learning.utils import set_policy_values
+
+# Bump when the layout of the saved tables changes
+TABLES_FORMAT_VERSION = 1
+
+
+class PolicyTables:
+    """
+    Value functions and action probabilities of a policy, stored as arrays indexed by the ids of
+    its compiled form (see `Policy.compile()`). The environment itself is shared and never copied:
+    several tables can be learned and compared on the same `Turn()`.
+
+    The learning algorithms also record on their output the number of iterations they ran (`n_iter`)
+    and the reason they stopped (`stop_reason`: 'n_iter', 'tol', 'n_stable' or 'max_time').
+    """
+
+    def __init__(self, compiled, state_values=None, action_values=None, probabilities=None):
+        self.compiled = compiled
+        self.state_values = np.zeros(compiled.n_states) if state_values is None else state_values
+        self.action_values = np.zeros(compiled.n_actions) if action_values is None else action_values
+        self.probabilities = compiled.probabilities.copy() if probabilities is None else probabilities
+        self.n_iter = None
+        self.stop_reason = None
+
+    @classmethod
+    def from_policy(cls, policy):
+        """Read the current value functions and probabilities of the states and actions of a policy."""
+        actions = [action for state in policy.states for action in state.actions]
+        return cls(policy.compile(),
+                   state_values=np.array([state.value_function for state in policy.states], dtype=float),
+                   action_values=np.array([action.value_function for action in actions], dtype=float),
+                   probabilities=np.array([action.probability for action in actions], dtype=float))
+
+    def copy(self):
+        return PolicyTables(self.compiled, self.state_values.copy(), self.action_values.copy(),
+                            self.probabilities.copy())
+
+    def apply(self, policy):
+        """Write the tables onto the states and actions of a policy (e.g. a copy of the original `Turn()`)."""
+        set_policy_values(policy, self.state_values, self.action_values, self.probabilities)
+        return policy
+
+    def _state_id(self, state):
+        return self.compiled.state_index[getattr(state, 'id', state)]
+
+    def _action_id(self, action):
+        if not isinstance(action, tuple):
+            action = (action.from_state.id, action.id)
+        return self.compiled.action_index[action]
+
+    def value_function(self, state):
+        """Return the value function of a state, given as a State() or its `State.id`."""
+        return self.state_values[self._state_id(state)]
+
+    def action_value(self, action):
+        """Return the value function of an action, given as an Action() or a pair (`State.id`, `Action.id`)."""
+        return self.action_values[self._action_id(action)]
+
+    def probability(self, action):
+        """Return the probability of an action, given as an Action() or a pair (`State.id`, `Action.id`)."""
+        return self.probabilities[self._action_id(action)]
+
+
+def get_tables(policy):
+    """
+    Return new tables to learn on: a copy of `policy` if it is already a PolicyTables(),
+    otherwise the current values of the policy.
+    """
+    if isinstance(policy, PolicyTables):
+        return policy.copy()
+    return PolicyTables.from_policy(policy)
+
+
+def save_tables(tables, path, dtype=None, metadata=None):
+    """
+    Save the value functions and probabilities of tables in a single compressed `.npz` file, with
+    the ids of their states and actions (`State.id` and (`State.id`, `Action.id`)), so that they can be
+    loaded on any compiled form of the same environment.
+
+    :param tables: The PolicyTables() to save
+    :param path: The file to write (replaced if it already exists)
+    :param dtype: The type of the saved values (e.g. `np.float32` to halve the file), unchanged if None
+    :param metadata: A JSON-serializable dict stored alongside the arrays (optional)
+    """
+    compiled = tables.compiled
+    header = {'version': TABLES_FORMAT_VERSION, 'n_iter': tables.n_iter, 'stop_reason': tables.stop_reason,
+              'metadata': metadata or {}}
+    ids = {'state_ids': compiled.state_ids, 'action_ids': compiled.action_ids}
+
+    # Write in a temporary file first, so that a reader never sees a partial file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+    with os.fdopen(fd, 'wb') as file:
+        np.savez_compressed(file,
+                            header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+                            ids=np.frombuffer(json.dumps(ids).encode(), dtype=np.uint8),
+                            state_values=np.asarray(tables.state_values, dtype=dtype),
+                            action_values=np.asarray(tables.action_values, dtype=dtype),
+                            probabilities=np.asarray(tables.probabilities, dtype=dtype))
+    os.replace(tmp_path, path)
+
+
+def read_tables(path):
+    """
+    Read the content of tables saved with `save_tables`, without any environment.
+
+    :return: A dict with the arrays `state_values`, `action_values` and `probabilities`, the lists
+    `state_ids` and `action_ids` giving their keys, and the saved `n_iter`, `stop_reason` and `metadata`
+    """
+    with np.load(path) as file:
+        header = json.loads(file['header'].tobytes())
+        if header['version'] != TABLES_FORMAT_VERSION:
+            raise ValueError(f"Unsupported version of the tables format: {header['version']} "
+                             f"(expected {TABLES_FORMAT_VERSION}).")
+        ids = json.loads(file['ids'].tobytes())
+        content = {name: file[name].astype(float) for name in ('state_values', 'action_values', 'probabilities')}
+
+    content['state_ids'] = [_to_tuple(state_id) for state_id in ids['state_ids']]
+    content['action_ids'] = [_to_tuple(action_id) for action_id in ids['action_ids']]
+    content.update(n_iter=header['n_iter'], stop_reason=header['stop_reason'], metadata=header['metadata'])
+    return content
+
+
+def load_tables(path, compiled):
+    """
+    Load tables saved with `save_tables` on a compiled environment (e.g. `game.cache.load_turn()`, which
+    is neither rebuilt nor copied). The values are matched by the ids of the states and actions, so the
+    order of the compiled form may differ from the saved one.
+
+    :param path: The saved file
+    :param compiled: The CompiledPolicy() of the environment
+
+    :return: A PolicyTables()
+    """
+    content = read_tables(path)
+
+    arrays = {}
+    for name, ids, index, size in (('state_values', content['state_ids'], compiled.state_index, compiled.n_states),
+                                   ('action_values', content['action_ids'], compiled.action_index, compiled.n_actions),
+                                   ('probabilities', content['action_ids'], compiled.action_index, compiled.n_actions)):
+        if len(ids) != size:
+            raise ValueError(f'The saved tables do not match the environment: {len(ids)} values for {size} ids.')
+        try:
+            order = np.array([index[saved_id] for saved_id in ids], dtype=np.int64)
+        except KeyError as error:
+            raise ValueError(f'The saved tables do not match the environment: unknown id {error}.') from None
+        arrays[name] = np.empty(size)
+        arrays[name][order] = content[name]
+
+    tables = PolicyTables(compiled, **arrays)
+    tables.n_iter, tables.stop_reason = content['n_iter'], content['stop_reason']
+    return tables
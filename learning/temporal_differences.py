@@ -1,49 +1,222 @@
-from copy import deepcopy
+import numpy as np
 
-from learning.utils import select_random_state, select_random_action
+from learning.monitoring import get_monitor, close_monitor
+from learning.tables import get_tables
+from learning.utils import (SegmentSampler, select_random_states, greedy_probabilities, draw_in_chunks,
+                            group_by_indices)
 
 
-def td0(policy, alpha=.1, gamma=1, n_iter=100):
-    policy = deepcopy(policy)
-    for state in policy.states:
-        state.value_function = 0
+def _update(values, indices, targets, alpha):
+    """
+    Move the values of `indices` towards their `targets`, the targets of a repeated index being averaged
+    (so that a batch of transitions is applied at once, whatever its order).
+    """
+    updated, counts, errors = group_by_indices(indices, targets - values[indices], len(values))
+    values[updated] += alpha * errors / counts
 
-    for it in range(n_iter):
-        state = select_random_state(policy.states)
 
-        while not state.is_terminal:
-            action = select_random_action(state, use_policy=True)
-            next_state = action(use_weights=True)
-            state.value_function += alpha * (action.reward +
-                                             gamma * next_state.value_function -
-                                             state.value_function)
-            state = next_state
+def td0(policy, alpha=.1, gamma=1, n_iter=100, rng=None, callback=None, callback_every=1000, stopping=None,
+        batch_size=1):
+    tables = get_tables(policy)
+    compiled = tables.compiled
+    rng = np.random.default_rng(rng)
 
-    return policy
+    state_values = tables.state_values
+    state_values[:] = 0
+    action_sampler = SegmentSampler(compiled.action_ptr, tables.probabilities)
+    monitor = get_monitor(tables, state_values, callback, callback_every, stopping,
+                          lambda: compiled.rewards + gamma * compiled.expected_values(state_values))
 
+    if batch_size > 1:
+        # Synchronous updates: the episodes of a batch move forward together, one step at a time
+        for start in range(0, n_iter, batch_size):
+            states = rng.integers(compiled.n_states, size=min(batch_size, n_iter - start))
+            n_episodes = len(states)
 
-def sarsa(policy, alpha=.1, gamma=1, n_iter=100):
-    policy = deepcopy(policy)
-    for state in policy.states:
-        if state.is_terminal:
-            state.value_function = 0
+            states = states[~compiled.is_terminal[states]]
+            while len(states):
+                actions = action_sampler(states, rng)
+                next_states = compiled.sample_successors(actions, rng)
+                _update(state_values, states, compiled.rewards[actions] + gamma * state_values[next_states], alpha)
+                if monitor is not None:
+                    monitor.visit(states)
+                states = next_states[~compiled.is_terminal[next_states]]
 
-    for it in range(n_iter):
-        state, action = select_random_state(policy.states, select_action=True, use_policy=True)
+            if monitor is not None and monitor.step(n_episodes):
+                break
 
-        while not state.is_terminal:
-            next_state = action(use_weights=True)
-            if next_state.is_terminal:
-                next_action = None
-                next_q = 0
-            else:
-                next_action = select_random_action(next_state, use_policy=True)
-                next_q = next_action.value_function
+    else:
+        for state in draw_in_chunks(lambda n: rng.integers(compiled.n_states, size=n), n_iter):
 
-            action.value_function += alpha * (action.reward +
-                                              gamma * next_q -
-                                              action.value_function)
-            state = next_state
-            action = next_action
+            while not compiled.is_terminal[state]:
+                action = action_sampler.sample(state, rng)
+                next_state = compiled.sample_successor(action, rng)
+                state_values[state] += alpha * (compiled.rewards[action] +
+                                                gamma * state_values[next_state] -
+                                                state_values[state])
+                if monitor is not None:
+                    monitor.visit(state)
+                state = next_state
 
-    return policy
+            if monitor is not None and monitor.step():
+                break
+
+    close_monitor(monitor, tables, n_iter)
+    return tables
+
+
+def sarsa(policy, alpha=.1, gamma=1, n_iter=100, rng=None, callback=None, callback_every=1000, stopping=None,
+          batch_size=1):
+    tables = get_tables(policy)
+    compiled = tables.compiled
+    rng = np.random.default_rng(rng)
+
+    action_values = tables.action_values
+    action_values[compiled.is_terminal[compiled.action_states]] = 0
+    action_sampler = SegmentSampler(compiled.action_ptr, tables.probabilities)
+    monitor = get_monitor(tables, action_values, callback, callback_every, stopping)
+
+    if batch_size > 1:
+        # Synchronous updates: the episodes of a batch move forward together, one step at a time
+        for start in range(0, n_iter, batch_size):
+            states, actions = select_random_states(compiled, min(batch_size, n_iter - start), select_action=True,
+                                                   use_policy=True, probabilities=tables.probabilities, rng=rng)
+            n_episodes = len(states)
+
+            while len(actions):
+                next_states = compiled.sample_successors(actions, rng)
+                is_terminal = compiled.is_terminal[next_states]
+                next_q = np.zeros(len(actions))
+                next_actions = action_sampler(next_states[~is_terminal], rng)
+                next_q[~is_terminal] = action_values[next_actions]
+
+                _update(action_values, actions, compiled.rewards[actions] + gamma * next_q, alpha)
+                if monitor is not None:
+                    monitor.visit(compiled.action_states[actions])
+                actions = next_actions
+
+            if monitor is not None and monitor.step(n_episodes):
+                break
+
+    else:
+        starts = lambda n: zip(*select_random_states(compiled, n, select_action=True, use_policy=True,
+                                                     probabilities=tables.probabilities, rng=rng))
+        for state, action in draw_in_chunks(starts, n_iter):
+
+            while not compiled.is_terminal[state]:
+                next_state = compiled.sample_successor(action, rng)
+                if compiled.is_terminal[next_state]:
+                    next_action = None
+                    next_q = 0
+                else:
+                    next_action = action_sampler.sample(next_state, rng)
+                    next_q = action_values[next_action]
+
+                action_values[action] += alpha * (compiled.rewards[action] +
+                                                  gamma * next_q -
+                                                  action_values[action])
+                if monitor is not None:
+                    monitor.visit(state)
+                state = next_state
+                action = next_action
+
+            if monitor is not None and monitor.step():
+                break
+
+    close_monitor(monitor, tables, n_iter)
+    return tables
+
+
+def _state_values(compiled, action_values, probabilities, greedy):
+    """Value of each state given the action values: their expectation under the policy, or their maximum."""
+    if not greedy:
+        return np.bincount(compiled.action_states, weights=probabilities * action_values, minlength=compiled.n_states)
+    has_actions = compiled.n_actions_per_state > 0
+    state_values = np.zeros(compiled.n_states)
+    state_values[has_actions] = np.maximum.reduceat(action_values, compiled.action_ptr[:-1][has_actions])
+    return state_values
+
+
+def _expected_updates(policy, alpha, gamma, n_iter, rng, callback, callback_every, stopping, batch_size, greedy):
+    """
+    Learn the action values along episodes following the policy, with targets computed from the exact
+    distribution of the next states: their values are the expectation of their action values under
+    the policy (Expected SARSA), or their maximum (Q-learning).
+    """
+    tables = get_tables(policy)
+    compiled = tables.compiled
+    rng = np.random.default_rng(rng)
+
+    action_values, probabilities = tables.action_values, tables.probabilities
+    action_sampler = SegmentSampler(compiled.action_ptr, probabilities)
+    if batch_size == 1:
+        # The values of the states and afterstates are kept up to date with the action values: each sequential
+        # update reads one afterstate value, and only writes to the afterstates leading to its state
+        state_values = _state_values(compiled, action_values, probabilities, greedy)
+        afterstate_values = compiled.afterstate_values(state_values)
+    monitor = get_monitor(tables, action_values, callback, callback_every, stopping)
+
+    if batch_size > 1:
+        for start in range(0, n_iter, batch_size):
+            states, actions = select_random_states(compiled, min(batch_size, n_iter - start), select_action=True,
+                                                   use_policy=True, probabilities=probabilities, rng=rng)
+            n_episodes = len(states)
+
+            while len(actions):
+                afterstate_values = compiled.afterstate_values(_state_values(compiled, action_values, probabilities,
+                                                                             greedy))
+                _update(action_values, actions,
+                        compiled.rewards[actions] + gamma * afterstate_values[compiled.action_afterstates[actions]],
+                        alpha)
+                if monitor is not None:
+                    monitor.visit(compiled.action_states[actions])
+
+                next_states = compiled.sample_successors(actions, rng)
+                actions = action_sampler(next_states[~compiled.is_terminal[next_states]], rng)
+
+            if monitor is not None and monitor.step(n_episodes):
+                break
+
+    else:
+        starts = lambda n: zip(*select_random_states(compiled, n, select_action=True, use_policy=True,
+                                                     probabilities=probabilities, rng=rng))
+        for state, action in draw_in_chunks(starts, n_iter):
+
+            while not compiled.is_terminal[state]:
+                error = alpha * (compiled.rewards[action] +
+                                 gamma * afterstate_values[compiled.action_afterstates[action]] -
+                                 action_values[action])
+                action_values[action] += error
+                if greedy:
+                    state_value = action_values[compiled.action_ptr[state]:compiled.action_ptr[state + 1]].max()
+                else:
+                    state_value = state_values[state] + probabilities[action] * error
+                previous_afterstates, previous_probabilities = compiled.get_predecessors(state)
+                afterstate_values[previous_afterstates] += previous_probabilities * (state_value - state_values[state])
+                state_values[state] = state_value
+
+                if monitor is not None:
+                    monitor.visit(state)
+                state = compiled.sample_successor(action, rng)
+                if not compiled.is_terminal[state]:
+                    action = action_sampler.sample(state, rng)
+
+            if monitor is not None and monitor.step():
+                break
+
+    close_monitor(monitor, tables, n_iter)
+    return tables
+
+
+def expected_sarsa(policy, alpha=.1, gamma=1, n_iter=100, rng=None, callback=None, callback_every=1000,
+                   stopping=None, batch_size=1):
+    return _expected_updates(policy, alpha, gamma, n_iter, rng, callback, callback_every, stopping, batch_size,
+                             greedy=False)
+
+
+def q_learning(policy, alpha=.1, gamma=1, n_iter=100, rng=None, callback=None, callback_every=1000,
+               stopping=None, batch_size=1):
+    tables = _expected_updates(policy, alpha, gamma, n_iter, rng, callback, callback_every, stopping, batch_size,
+                               greedy=True)
+    tables.probabilities = greedy_probabilities(tables.compiled, tables.action_values)
+    return tables
@@ -1,4 +1,6 @@
-from random import choices
+from random import choices, random
+
+import numpy as np
 
 
 def g(episode, t, gamma):
@@ -17,6 +19,89 @@ def g(episode, t, gamma):
     return output
 
 
+def discounted_returns(rewards, gamma):
+    """
+    Compute the complete returns of every step of a batch of episodes, in a single backward pass.
+
+    :param rewards: Array of rewards of shape (n_episodes, length), padded with 0
+    :param gamma: Reward reducer parameter
+
+    :return: Array of returns of the same shape
+    """
+    returns = np.zeros(np.shape(rewards))
+    following = np.zeros(len(rewards))
+    for t in range(np.shape(rewards)[1] - 1, -1, -1):
+        following = rewards[:, t] + gamma * following
+        returns[:, t] = following
+    return returns
+
+
+def first_visits(indices):
+    """
+    Mark the first visit of each state (or action) in each episode of a batch.
+
+    :param indices: Array of state (or action) ids of shape (n_episodes, length), padded with -1
+
+    :return: A boolean array of the same shape
+    """
+    indices = np.asarray(indices)
+    keys = np.arange(len(indices))[:, None] * (indices.max(initial=0) + 2) + (indices + 1)
+    visits = np.zeros(indices.size, dtype=bool)
+    visits[np.unique(keys, return_index=True)[1]] = True
+    return visits.reshape(indices.shape) & (indices >= 0)
+
+
+def group_by_indices(indices, values, size):
+    """
+    Count and sum the `values` of each index (the indices being in `range(size)` and possibly repeated),
+    in O(len(indices)) when they are few compared to `size`.
+
+    :param indices: Array of indices
+    :param values: Array of values of the same length
+    :param size: The number of possible indices
+
+    :return: A tuple of arrays (distinct indices, their counts, the sums of their values)
+    """
+    if 8 * len(indices) < size:
+        grouped, inverse, counts = np.unique(indices, return_inverse=True, return_counts=True)
+        return grouped, counts, np.bincount(inverse, weights=values, minlength=len(grouped))
+
+    # Many indices: counting over the whole range is cheaper than sorting them
+    counts = np.bincount(indices, minlength=size)
+    grouped = np.flatnonzero(counts)
+    return grouped, counts[grouped], np.bincount(indices, weights=values, minlength=size)[grouped]
+
+
+class RunningMean:
+    """
+    Running count and mean of the returns of many states (or actions), in constant memory.
+    """
+
+    def __init__(self, size):
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.means = np.zeros(size)
+
+    def update(self, indices, values):
+        """Add the `values` observed for the given `indices` (which can be repeated)."""
+        updated, counts, sums = group_by_indices(indices, values, len(self.counts))
+        self.counts[updated] += counts
+        self.means[updated] += (sums - counts * self.means[updated]) / self.counts[updated]
+        return updated
+
+    def merge(self, other):
+        """Add the statistics of another RunningMean() (e.g. computed by another process)."""
+        counts = self.counts + other.counts
+        updated = np.flatnonzero(counts)
+        self.means[updated] = (self.counts[updated] * self.means[updated] +
+                               other.counts[updated] * other.means[updated]) / counts[updated]
+        self.counts = counts
+        return self
+
+    @property
+    def visited(self):
+        return self.counts > 0
+
+
 def generate_episode(origin_state, origin_action=None, use_policy=False, max_step=1000):
     """
     Generate an episode.
@@ -31,7 +116,7 @@ def generate_episode(origin_state, origin_action=None, use_policy=False, max_ste
 
     if origin_action is not None:
         episode = [(origin_action.from_state, origin_action)]
-        current_state = choices(origin_action.to_states)[0]
+        current_state = origin_action(use_weights=True)
         t = 1
     else:
         episode = []
@@ -39,14 +124,11 @@ def generate_episode(origin_state, origin_action=None, use_policy=False, max_ste
         t = 0
 
     while t < max_step and not current_state.is_terminal:
-        actions = current_state.actions
-        if use_policy:
-            action = choices(actions, weights=actions.probabilities)[0]
-        else:
-            action = choices(actions)[0]
+        action = current_state.actions.sample(use_policy)
 
         episode.append((current_state, action))
-        current_state = choices(action.to_states)[0]
+        current_state = action(use_weights=True)
+        t += 1
 
     return episode
 
@@ -86,6 +168,310 @@ def select_random_action(state, use_policy=False):
     if state.is_terminal:
         return None
 
-    if use_policy:
-        return choices(state.actions, weights=state.actions.probabilities)[0]
-    return choices(state.actions)[0]
+    return state.actions.sample(use_policy)
+
+
+class AliasTable:
+    """
+    Alias table (Vose's method) of a discrete distribution: once built in O(n), each draw costs
+    two uniform numbers and no allocation, whatever the number of outcomes.
+    """
+
+    def __init__(self, weights):
+        """
+        :param weights: The (non normalised) weights of the outcomes
+        """
+        self.n = n = len(weights)
+        total = sum(weights)
+        scaled = [weight * n / total for weight in weights]
+        self._probabilities = [1.] * n
+        self._aliases = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.]
+        large = [i for i, p in enumerate(scaled) if p >= 1.]
+        while small and large:
+            i, j = small.pop(), large[-1]
+            self._probabilities[i] = scaled[i]
+            self._aliases[i] = j
+            scaled[j] -= 1. - scaled[i]
+            if scaled[j] < 1.:
+                small.append(large.pop())
+        # The remaining outcomes have a probability of 1 (up to rounding errors)
+
+    def sample(self):
+        """Draw the index of an outcome."""
+        u = random() * self.n
+        i = int(u)
+        if u - i < self._probabilities[i]:
+            return i
+        return self._aliases[i]
+
+
+def segment_indices(ptr, segments):
+    """
+    Concatenate the indices of the given segments `ptr[i]:ptr[i + 1]` (e.g. the actions of some states),
+    in O(their total size).
+
+    :param ptr: The offsets of the segments
+    :param segments: Array of segment ids
+
+    :return: An array of indices
+    """
+    starts, sizes = ptr[segments], ptr[segments + 1] - ptr[segments]
+    return np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(sizes.sum())
+
+
+class SegmentSampler:
+    """
+    Sample, for many segments `ptr[i]:ptr[i + 1]` of a weights array at once, one index per segment
+    with a probability proportional to its weight (e.g. the actions of states, or the next states of actions).
+
+    The cumulative weights of each segment `i` are normalized to (i, i + 1]: they are sorted over the
+    whole array, and the weights of a few segments can be changed without reading the others (see `update`).
+    """
+
+    def __init__(self, ptr, weights=None):
+        self._ptr = ptr
+        self._cumsum = np.empty(ptr[-1])
+        self.update(np.ones(ptr[-1]) if weights is None else weights)
+
+    def update(self, weights, segments=None):
+        """Read again the weights of the given segments (all of them if None), in O(their size)."""
+        if segments is None:
+            segments, indices = np.arange(len(self._ptr) - 1), slice(None)
+        else:
+            segments = np.unique(segments)
+            indices = segment_indices(self._ptr, segments)
+        sizes = self._ptr[segments + 1] - self._ptr[segments]
+        segments, sizes = segments[sizes > 0], sizes[sizes > 0]
+        if len(segments) == 0:
+            return
+
+        segment_weights = np.asarray(weights, dtype=float)[indices]
+        starts = np.cumsum(sizes) - sizes
+        cumsum = np.cumsum(segment_weights)
+        cumsum = np.maximum(cumsum - np.repeat(cumsum[starts] - segment_weights[starts], sizes), 0.)
+        totals = cumsum[starts + sizes - 1]
+        totals[totals <= 0.] = 1.
+        self._cumsum[indices] = np.repeat(segments, sizes) + cumsum / np.repeat(totals, sizes)
+
+    def sample(self, segment, rng):
+        """Sample one index in a single segment."""
+        start, stop = self._ptr[segment], self._ptr[segment + 1]
+        index = np.searchsorted(self._cumsum[start:stop], int(segment) + rng.random(), side='right')
+        return start + min(index, stop - start - 1)
+
+    def __call__(self, segments, rng):
+        indices = np.searchsorted(self._cumsum, segments + rng.random(len(segments)), side='right')
+        return np.clip(indices, self._ptr[segments], self._ptr[segments + 1] - 1)
+
+
+def generate_episodes(compiled, n_episodes, origin_states=None, origin_actions=None,
+                      use_policy=False, probabilities=None, max_step=1000, rng=None, action_sampler=None):
+    """
+    Generate a batch of episodes at once on a compiled policy.
+
+    :param compiled: The CompiledPolicy() to simulate
+    :param n_episodes: Number of episodes to generate
+    :param origin_states: Starting states of the episodes (random states if None)
+    :param origin_actions: First actions to choose (optional), overrides `origin_states`
+    :param use_policy: Use the action probabilities to choose the actions, otherwise choose them uniformly
+    :param probabilities: Action probabilities to use instead of `compiled.probabilities` (if `use_policy=True`)
+    :param max_step: Maximal number of step in the episodes
+    :param rng: A numpy Generator, or a seed
+    :param action_sampler: A SegmentSampler() of the actions to reuse, instead of building one from the
+    probabilities (e.g. over the batches of a training, updated with the probabilities it changes)
+
+    :return: A tuple of arrays (states, actions, rewards) of shape (n_episodes, length),
+             padded with -1 (and 0 rewards) after the end of each episode
+    """
+    rng = np.random.default_rng(rng)
+
+    if action_sampler is None and use_policy:
+        action_sampler = SegmentSampler(compiled.action_ptr,
+                                        compiled.probabilities if probabilities is None else probabilities)
+    elif action_sampler is None:
+        action_sampler = SegmentSampler(compiled.action_ptr)
+
+    if origin_actions is not None:
+        current_states = compiled.action_states[origin_actions]
+    elif origin_states is not None:
+        current_states = np.array(origin_states, dtype=np.int64)
+    else:
+        current_states = select_random_states(compiled, n_episodes, rng=rng)
+
+    states, actions = [], []
+    active = compiled.n_actions_per_state[current_states] > 0
+    t = 0
+    while t < max_step and active.any():
+        rows = np.flatnonzero(active)
+        if t == 0 and origin_actions is not None:
+            selected_actions = np.asarray(origin_actions)[rows]
+        else:
+            selected_actions = action_sampler(current_states[rows], rng)
+
+        step_states = np.full(n_episodes, -1, dtype=np.int64)
+        step_actions = np.full(n_episodes, -1, dtype=np.int64)
+        step_states[rows] = current_states[rows]
+        step_actions[rows] = selected_actions
+        states.append(step_states)
+        actions.append(step_actions)
+
+        current_states[rows] = compiled.sample_successors(selected_actions, rng)
+        active[rows] = compiled.n_actions_per_state[current_states[rows]] > 0
+        t += 1
+
+    if t == 0:
+        empty = np.empty((n_episodes, 0), dtype=np.int64)
+        return empty, empty, np.empty((n_episodes, 0))
+
+    states, actions = np.stack(states, axis=1), np.stack(actions, axis=1)
+    rewards = np.where(actions >= 0, compiled.rewards[actions], 0.)
+    return states, actions, rewards
+
+
+def _state_actions(compiled, states=None):
+    """Return the number of actions of the states having some (all of them if None), and their actions."""
+    states = np.arange(compiled.n_states) if states is None else np.asarray(states)
+    n_actions = compiled.n_actions_per_state[states]
+    states, n_actions = states[n_actions > 0], n_actions[n_actions > 0]
+    return n_actions, segment_indices(compiled.action_ptr, states)
+
+
+def best_actions(compiled, action_values, tol=1e-12, states=None):
+    """
+    Mark the actions whose value is the best among the actions of their state.
+
+    :param compiled: The CompiledPolicy() the actions belong to
+    :param action_values: The value function of each action
+    :param tol: Tolerance under which two action values are considered equal
+    :param states: Only mark the actions of these states, in the order of
+    `segment_indices(compiled.action_ptr, states)` (all the actions if None)
+
+    :return: A boolean array over the actions
+    """
+    n_actions, actions = _state_actions(compiled, states)
+    if len(actions) == 0:
+        return np.zeros(0, dtype=bool)
+    values = action_values[actions]
+    best_values = np.maximum.reduceat(values, np.cumsum(n_actions) - n_actions)
+    return values >= np.repeat(best_values, n_actions) - tol
+
+
+def greedy_probabilities(compiled, action_values, tol=1e-12, states=None):
+    """
+    Return the probabilities of the greedy policy given the action values, the ties being
+    shared uniformly between the best actions of a state.
+
+    :param compiled: The CompiledPolicy() the actions belong to
+    :param action_values: The value function of each action
+    :param tol: Tolerance under which two action values are considered equal
+    :param states: Only compute the probabilities of the actions of these states (see `best_actions`)
+
+    :return: An array of action probabilities
+    """
+    n_actions, _ = _state_actions(compiled, states)
+    is_best = best_actions(compiled, action_values, tol, states)
+    if len(is_best) == 0:
+        return np.zeros(0)
+    n_best = np.add.reduceat(is_best, np.cumsum(n_actions) - n_actions)
+    return is_best / np.repeat(n_best, n_actions)
+
+
+def epsilon_greedy_probabilities(compiled, action_values, epsilon, tol=1e-12, states=None):
+    """
+    Return the probabilities of the epsilon-greedy policy given the action values: every action gets
+    `epsilon / n_actions`, and the best actions share `1 - epsilon` uniformly (as in `greedy_probabilities`).
+
+    :param compiled: The CompiledPolicy() the actions belong to
+    :param action_values: The value function of each action
+    :param epsilon: The epislon-greedy policy parameter
+    :param tol: Tolerance under which two action values are considered equal
+    :param states: Only compute the probabilities of the actions of these states (see `best_actions`)
+
+    :return: An array of action probabilities
+    """
+    n_actions, _ = _state_actions(compiled, states)
+    exploration = np.repeat(epsilon / n_actions, n_actions)
+    return (1 - epsilon) * greedy_probabilities(compiled, action_values, tol, states) + exploration
+
+
+def set_policy_values(policy, state_values=None, action_values=None, probabilities=None):
+    """
+    Write arrays indexed by the compiled ids (see `Policy.compile()`) onto the states and actions of a policy.
+
+    :param policy: The policy to update
+    :param state_values: Array of state value functions (optional)
+    :param action_values: Array of action value functions (optional)
+    :param probabilities: Array of action probabilities (optional)
+    """
+    action_id = 0
+    for state_id, state in enumerate(policy.states):
+        if state_values is not None:
+            state.value_function = state_values[state_id]
+        for action in state.actions:
+            if action_values is not None:
+                action.value_function = action_values[action_id]
+            if probabilities is not None:
+                action.probability = probabilities[action_id]
+            action_id += 1
+
+
+def draw_in_chunks(draw, n_iter, chunk_size=1024):
+    """
+    Yield `n_iter` random items, drawn `chunk_size` at a time by `draw(n)` (which returns `n` items): a training
+    stopped early neither draws nor stores the items of the iterations it does not run.
+
+    :param draw: The function drawing a given number of items
+    :param n_iter: The total number of items
+    :param chunk_size: The number of items drawn at once
+    """
+    for start in range(0, n_iter, chunk_size):
+        yield from draw(min(chunk_size, n_iter - start))
+
+
+def select_random_states(compiled, n_states, select_action=False, use_policy=False, probabilities=None, rng=None):
+    """
+    Randomly select a batch of states of a compiled policy (see `select_random_state`).
+
+    :param compiled: The CompiledPolicy() to select the states from
+    :param n_states: Number of states to select
+    :param select_action: If True, also choose a random action (with a non-zero probability) for each non-terminal state
+    :param use_policy: If True and `select_action=True`, use the policy distribution to select the actions
+    :param probabilities: Action probabilities to use instead of `compiled.probabilities`
+    :param rng: A numpy Generator, or a seed
+
+    :return: An array of states, or a tuple of arrays (states, actions) if `select_action=True`
+    """
+    rng = np.random.default_rng(rng)
+
+    if not select_action:
+        return rng.integers(compiled.n_states, size=n_states)
+
+    if probabilities is None:
+        probabilities = compiled.probabilities
+    if n_states == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if compiled.n_actions == 0:
+        raise ValueError('No action can be selected: the policy has no actions.')
+    action_sampler = SegmentSampler(compiled.action_ptr, probabilities) if use_policy else None
+
+    # Draw a non-terminal state, then an action, until the action has a non-zero probability: by rounds of
+    # candidates, so that (without the policy) the cost does not depend on the number of actions
+    states, actions = [], []
+    n_selected = 0
+    while n_selected < n_states:
+        candidates = rng.integers(compiled.n_states, size=8 * (n_states - n_selected) + 16)
+        candidates = candidates[~compiled.is_terminal[candidates] & (compiled.n_actions_per_state[candidates] > 0)]
+        n_actions = compiled.n_actions_per_state[candidates]
+        if use_policy:
+            selected = action_sampler(candidates, rng)
+        else:
+            selected = compiled.action_ptr[candidates] + (rng.random(len(candidates)) * n_actions).astype(np.int64)
+
+        is_valid = probabilities[selected] > 0.
+        states.append(candidates[is_valid])
+        actions.append(selected[is_valid])
+        n_selected += int(is_valid.sum())
+
+    return np.concatenate(states)[:n_states], np.concatenate(actions)[:n_states]
@@ -1,17 +1,15 @@
-# TODO: Ajouter un poids (ou probabilité) aux états suivants
 # TODO: Docstrings et commentaires
+import argparse
 
 
-def main():
-    pass
-
-
-if __name__ == '__main__':
-    # main()
-
+def main(n_iter=100000, gamma=.8, alpha=.5, n_jobs=1, tol=None, max_time=None):
     from game.components import Turn
     from learning.monte_carlo import predictions, exploring_starts, on_policy_control
-    from learning.temporal_differences import td0, sarsa
+    from learning.temporal_differences import td0, sarsa, expected_sarsa, q_learning
+    from learning.dynamic_programming import evaluate_policy, value_iteration
+    from learning.parallel import parallel_predictions, parallel_on_policy_control, run_concurrently
+    from learning.tables import PolicyTables
+    from learning.monitoring import EarlyStopping
 
     turn = Turn(init_policy='uniform')
 
@@ -23,14 +21,62 @@ if __name__ == '__main__':
     print('Number of states: {}'.format(n_states))
     print('Number of actions: {}'.format(n_actions))
 
-    n_iter = 100000
-    gamma = .8
-    alpha = .5
+    # n_iter is then only an upper bound on the number of iterations
+    stopping = None
+    if tol is not None or max_time is not None:
+        stopping = EarlyStopping(tol=tol, max_time=max_time)
+
+    if n_jobs == 1:
+        predictions_policy = predictions(turn, gamma=gamma, n_iter=n_iter, first_visit=True, stopping=stopping)
+        exploring_starts_policy = exploring_starts(turn, gamma=gamma, n_iter=n_iter, stopping=stopping)
+        on_policy_control_policy = on_policy_control(turn, gamma=gamma, epsilon=.25, n_iter=n_iter, first_visit=True,
+                                                     stopping=stopping)
+        td0_policy = td0(turn, alpha=alpha, gamma=gamma, n_iter=n_iter, stopping=stopping)
+        sarsa_policy = sarsa(turn, alpha=alpha, gamma=gamma, n_iter=n_iter, stopping=stopping)
+        expected_sarsa_policy = expected_sarsa(turn, alpha=alpha, gamma=gamma, n_iter=n_iter, stopping=stopping)
+        q_learning_policy = q_learning(turn, alpha=alpha, gamma=gamma, n_iter=n_iter, stopping=stopping)
+    else:
+        # The Monte Carlo iterations are spread over the processes, then the
+        # remaining (sequential) algorithms run concurrently
+        tables = PolicyTables.from_policy(turn)
+        predictions_policy = parallel_predictions(tables, gamma=gamma, n_iter=n_iter, first_visit=True,
+                                                  n_jobs=n_jobs, stopping=stopping)
+        on_policy_control_policy = parallel_on_policy_control(tables, gamma=gamma, epsilon=.25, n_iter=n_iter,
+                                                              first_visit=True, n_jobs=n_jobs, stopping=stopping)
+        (exploring_starts_policy, td0_policy, sarsa_policy,
+         expected_sarsa_policy, q_learning_policy) = run_concurrently([
+            (exploring_starts, (tables,), {'gamma': gamma, 'n_iter': n_iter, 'stopping': stopping}),
+            (td0, (tables,), {'alpha': alpha, 'gamma': gamma, 'n_iter': n_iter, 'stopping': stopping}),
+            (sarsa, (tables,), {'alpha': alpha, 'gamma': gamma, 'n_iter': n_iter, 'stopping': stopping}),
+            (expected_sarsa, (tables,), {'alpha': alpha, 'gamma': gamma, 'n_iter': n_iter, 'stopping': stopping}),
+            (q_learning, (tables,), {'alpha': alpha, 'gamma': gamma, 'n_iter': n_iter, 'stopping': stopping}),
+        ], n_jobs=n_jobs)
 
-    predictions_policy = predictions(turn, gamma=gamma, n_iter=n_iter, first_visit=True)
-    exploring_starts_policy = exploring_starts(turn, gamma=gamma, n_iter=n_iter)
-    on_policy_control_policy = on_policy_control(turn, gamma=gamma, epsilon=.25, n_iter=n_iter, first_visit=True)
-    td0_policy = td0(turn, alpha=alpha, gamma=gamma, n_iter=n_iter)
-    sarsa_policy = sarsa(turn, alpha=alpha, gamma=gamma, n_iter=n_iter)
+    # The exact value of the initial state under each learned policy, next to the optimal one
+    optimal_policy = value_iteration(turn, gamma=gamma)
+    print('Optimal policy: value {:.4f}'.format(optimal_policy.state_values[0]))
+    for name, policy in [('Predictions', predictions_policy), ('Exploring starts', exploring_starts_policy),
+                         ('On-policy control', on_policy_control_policy), ('TD(0)', td0_policy),
+                         ('SARSA', sarsa_policy), ('Expected SARSA', expected_sarsa_policy),
+                         ('Q-learning', q_learning_policy)]:
+        print('{}: value {:.4f}, stopped after {} iterations ({})'.format(
+            name, evaluate_policy(policy, gamma=gamma).state_values[0], policy.n_iter, policy.stop_reason))
 
     # breakpoint()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-iter', type=int, default=100000)
+    parser.add_argument('--gamma', type=float, default=.8)
+    parser.add_argument('--alpha', type=float, default=.5)
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='Number of processes to spread the training over')
+    parser.add_argument('--tol', type=float, default=None,
+                        help='Stop a training once its values change by less than this over 1000 iterations')
+    parser.add_argument('--max-time', type=float, default=None,
+                        help='Wall-clock budget of each training (in seconds)')
+    args = parser.parse_args()
+
+    main(n_iter=args.n_iter, gamma=args.gamma, alpha=args.alpha, n_jobs=args.n_jobs, tol=args.tol,
+         max_time=args.max_time)